@@ -0,0 +1,234 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from assignment_rules import ALL_MEMBERS_KEY, UNKNOWN_MEMBER_KEY, normalize_name
+from expense import parse_cents
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from splitwise_client import Splitwise_client
+    from statement_store import Statement_store
+
+DEFAULT_MEMORY_PATH = ".assignment_memory.json"
+
+# Splitwise's shares are final (members fix bad splits there), so they outweigh the
+# assignments recorded in the statement store, which are GPT's
+SPLITWISE_WEIGHT = 3
+STATEMENT_WEIGHT = 1
+# A pattern needs this much weight behind one member, and this share of its total
+# weight, before it's trusted. One Splitwise expense is enough; one GPT answer isn't.
+MIN_WEIGHT = 2
+MIN_AGREEMENT = 0.75
+
+# Dates, times, amounts and counts, e.g. "10/12", "7:30pm", "$45.00", "#3"
+NUMBER_RE = re.compile(r"\$?\d+(?:[:/.,-]\d+)*\s*(?:am|pm)?\b", re.IGNORECASE)
+PUNCTUATION_RE = re.compile(r"[^\w/]+")
+
+
+def description_pattern(description: str) -> str:
+    """A description with its numbers and punctuation removed, so repeat charges match.
+
+    E.g. "Tennis Lesson w/ Coach Mike 10/12 7:30pm" -> "tennis lesson w/ coach mike".
+    """
+
+    text = NUMBER_RE.sub(" ", str(description))
+    text = PUNCTUATION_RE.sub(" ", text.replace("_", " "))
+    return normalize_name(text)
+
+
+def member_from_shares(expense: dict, id_to_name: Dict[int, str]) -> Optional[str]:
+    """Who a Splitwise expense was split to: one member, "All", or None for anything else."""
+
+    owing = [
+        user["user_id"]
+        for user in expense.get("users", [])
+        if parse_cents(user["owed_share"]) > 0
+    ]
+    members = {
+        user_id for user_id, name in id_to_name.items() if name != UNKNOWN_MEMBER_KEY
+    }
+    if len(owing) == 1 and owing[0] in id_to_name:
+        return id_to_name[owing[0]]
+    if len(members) > 1 and set(owing) == members:
+        return ALL_MEMBERS_KEY
+    return None
+
+
+class Learned_assignments:
+    """Assigns descriptions whose pattern past expenses agree on.
+
+    Works like Assignment_rules: assign() decides a single description, and apply()
+    decides the rows of a statement that the rules left ambiguous.
+    """
+
+    def __init__(self, votes: Dict[str, Counter], members: List[str]):
+        known = {normalize_name(member): member for member in members}
+        known[normalize_name(ALL_MEMBERS_KEY)] = ALL_MEMBERS_KEY
+
+        self.patterns = {}
+        for pattern, pattern_votes in votes.items():
+            # Members who have left the group can't be assigned
+            current = Counter()
+            for member, weight in pattern_votes.items():
+                if normalize_name(member) in known:
+                    current[known[normalize_name(member)]] += weight
+            if not current:
+                continue
+
+            total = sum(pattern_votes.values())
+            member, weight = current.most_common(1)[0]
+            if weight >= MIN_WEIGHT and weight >= MIN_AGREEMENT * total:
+                self.patterns[pattern] = member
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def assign(self, description: str) -> Optional[Tuple[str, str]]:
+        """(member, reason) if past expenses agree on this description, otherwise None."""
+
+        pattern = description_pattern(description)
+        if pattern not in self.patterns:
+            return None
+        member = self.patterns[pattern]
+        return member, f"Past expenses like '{pattern}' went to {member}"
+
+    def apply(self, statement: "pd.DataFrame") -> "pd.DataFrame":
+        """Assign the rows the rules left ambiguous (all rows, if there's no `ambiguous` column).
+
+        Returns a copy, with the rows decided here no longer marked ambiguous.
+        """
+
+        statement = statement.copy()
+        statement.columns = statement.columns.str.lower()
+        if "ambiguous" not in statement:
+            statement["ambiguous"] = True
+        if not self.patterns:
+            return statement
+
+        for index in statement.index[statement["ambiguous"].astype(bool)]:
+            assignment = self.assign(statement.at[index, "description"])
+            if assignment is not None:
+                statement.loc[index, ["assigned_member", "reason"]] = assignment
+                statement.at[index, "ambiguous"] = False
+        return statement
+
+
+class Assignment_memory:
+    """Each group's learned description pattern -> member votes, persisted to memory_path.
+
+    Votes come from the group's expenses on Splitwise (their final shares, so including
+    members' corrections) and from rows in the statement store that never made it to
+    Splitwise. Splitwise expenses are kept by ID, so re-learning only fetches expenses
+    updated since the last time, and edited or deleted expenses replace their old vote.
+    """
+
+    def __init__(self, memory_path: Optional[str] = DEFAULT_MEMORY_PATH):
+        self.memory_path = memory_path
+        self.lock = threading.Lock()
+        # str(group_id) -> {"learned_at": ..., "expenses": {id: [pattern, member]},
+        #                   "statements": {pattern: {member: count}}}
+        self.entries = self._load()
+
+    def _load(self) -> dict:
+        if not self.memory_path or not os.path.exists(self.memory_path):
+            return {}
+        try:
+            with open(self.memory_path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        if not self.memory_path:
+            return
+        tmp_path = f"{self.memory_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.entries, file, indent=4)
+        os.replace(tmp_path, self.memory_path)
+
+    def _entry(self, group_id) -> dict:
+        return self.entries.setdefault(
+            str(group_id), {"learned_at": None, "expenses": {}, "statements": {}}
+        )
+
+    def learn_from_splitwise(
+        self,
+        splitwise_client: "Splitwise_client",
+        group_id,
+        name_to_id: Dict[str, int],
+        refresh: bool = False,
+    ) -> int:
+        """Record the member each of the group's expenses is split to. Returns how many were fetched."""
+
+        id_to_name = {user_id: name for name, user_id in name_to_id.items()}
+        with self.lock:
+            entry = self._entry(group_id)
+            if refresh:
+                entry["expenses"] = {}
+            updated_after = None if refresh else entry["learned_at"]
+            started_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+            fetched = 0
+            for expense in splitwise_client.iter_expenses(
+                group_id, updated_after=updated_after
+            ):
+                fetched += 1
+                member = None
+                if not expense.get("deleted_at"):
+                    member = member_from_shares(expense, id_to_name)
+                if member is None:
+                    entry["expenses"].pop(str(expense["id"]), None)
+                else:
+                    entry["expenses"][str(expense["id"])] = [
+                        description_pattern(expense["description"]),
+                        member,
+                    ]
+
+            entry["learned_at"] = started_at
+            self._save()
+        return fetched
+
+    def learn_from_store(self, store: "Statement_store", group_id) -> int:
+        """Count GPT's assignments of stored rows that aren't on Splitwise. Returns how many were counted."""
+
+        from statement_store import DUPLICATE, UPLOADED
+
+        rows = store.query()
+        rows = rows[
+            (rows["group_id"] == str(group_id))
+            & rows["ambiguous"]
+            & (rows["assigned_member"] != UNKNOWN_MEMBER_KEY)
+            # Uploaded rows are learned from Splitwise, corrections included
+            & ~rows["upload_status"].isin([UPLOADED, DUPLICATE])
+        ]
+
+        statements = {}
+        for description, member in zip(rows["description"], rows["assigned_member"]):
+            votes = statements.setdefault(description_pattern(description), {})
+            votes[member] = votes.get(member, 0) + 1
+
+        with self.lock:
+            self._entry(group_id)["statements"] = statements
+            self._save()
+        return len(rows)
+
+    def learned(self, group_id, members: List[str]) -> Learned_assignments:
+        """The group's learned assignments, limited to its current members."""
+
+        with self.lock:
+            entry = self.entries.get(str(group_id), {})
+            votes = {}
+            for pattern, member in entry.get("expenses", {}).values():
+                votes.setdefault(pattern, Counter())[member] += SPLITWISE_WEIGHT
+            for pattern, pattern_votes in entry.get("statements", {}).items():
+                for member, count in pattern_votes.items():
+                    votes.setdefault(pattern, Counter())[member] += (
+                        count * STATEMENT_WEIGHT
+                    )
+        return Learned_assignments(votes, members)
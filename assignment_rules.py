@@ -0,0 +1,97 @@
+import re
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+# pandas is only needed by apply(), so importing the rules (e.g. via member_cache) is cheap
+if TYPE_CHECKING:
+    import pandas as pd
+
+UNKNOWN_MEMBER_KEY = "Unknown"
+ALL_MEMBERS_KEY = "All"
+
+DUES_RE = re.compile(r"\bdues\b", re.IGNORECASE)
+SHARED_RE = re.compile(r"\bshared\b", re.IGNORECASE)
+PARENTHESIZED_RE = re.compile(r"\([^)]*\)")
+
+
+class Assignment_rules:
+    """Deterministic versions of the assignment rules in the GPT prompt.
+
+    1. Dues are always "All".
+    2. Names in parentheses are ignored.
+    3. The first member named in the description wins (case-insensitive). Members can be
+       named by their full name, or by their first name if no other member shares it.
+    4. Anything "shared" is "All".
+
+    Rows none of these rules match are ambiguous and left for GPT.
+    """
+
+    def __init__(self, members: List[str]):
+        self.name_index = {}
+        first_names = [member.split()[0].casefold() for member in members if member]
+        for member in members:
+            if not member:
+                continue
+            self.name_index[normalize_name(member)] = member
+            first_name = member.split()[0].casefold()
+            if first_names.count(first_name) == 1:
+                self.name_index.setdefault(first_name, member)
+
+        # Longest names first so "John Doe" wins over "John" at the same position
+        names = sorted(self.name_index, key=len, reverse=True)
+        patterns = [r"\s+".join(map(re.escape, name.split())) for name in names]
+        self.name_re = (
+            re.compile(r"\b(?:" + "|".join(patterns) + r")\b", re.IGNORECASE)
+            if patterns
+            else None
+        )
+
+    def assign(self, description: str) -> Optional[Tuple[str, str]]:
+        """Return (member, reason) for a row description, or None if it's ambiguous."""
+
+        if not isinstance(description, str):
+            return None
+
+        if DUES_RE.search(description):
+            return ALL_MEMBERS_KEY, "Dues are always split among all members"
+
+        text = PARENTHESIZED_RE.sub(" ", description)
+
+        if self.name_re is not None and (match := self.name_re.search(text)):
+            member = self.name_index[normalize_name(match.group(0))]
+            return member, f"{member} is the first member named outside parentheses"
+
+        if SHARED_RE.search(text):
+            return ALL_MEMBERS_KEY, "Shared charges are split among all members"
+
+        return None
+
+    def apply(self, statement: "pd.DataFrame") -> "pd.DataFrame":
+        """Overwrite assigned_member/reason for every row the rules can decide.
+
+        Returns a copy with lower-cased column names and an `ambiguous` column marking
+        the rows the rules left alone.
+        """
+
+        import pandas as pd
+
+        statement = statement.copy()
+        statement.columns = statement.columns.str.lower()
+        if "assigned_member" not in statement:
+            statement["assigned_member"] = UNKNOWN_MEMBER_KEY
+        if "reason" not in statement:
+            statement["reason"] = ""
+
+        assignments = [
+            self.assign(description) for description in statement["description"]
+        ]
+        decided = pd.Series([a is not None for a in assignments], index=statement.index)
+
+        statement.loc[decided, "assigned_member"] = [a[0] for a in assignments if a]
+        statement.loc[decided, "reason"] = [a[1] for a in assignments if a]
+        statement["ambiguous"] = ~decided
+
+        return statement
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.split()).casefold()
@@ -0,0 +1,317 @@
+"""Parsing, processing and uploading a statement as concurrent asyncio stages.
+
+    setup ──> parse ──[rows queue]──> process ──[expenses queue]──> upload workers
+
+The setup calls that don't depend on each other run at the same time: fetching the
+group's members, importing the parser (and openai), and loading the learned assignments.
+Then, as both need the members, the parse cache is checked while the assistant is looked up.
+Parsing starts as soon as the members are known, and
+its rows are assigned, split and uploaded while the rest of the statement is still being
+parsed. Both queues are bounded, so a slow Splitwise holds back processing, and processing
+holds back parsing, instead of rows piling up in memory.
+
+The blocking work (HTTP calls, GPT, pypdf) runs in worker threads via asyncio.to_thread.
+If any stage fails, the others are cancelled and the parse thread stops at its next row
+batch, so the run ends with the stage's error instead of waiting on a queue forever.
+Uploads already sent still finish, and are returned on the PipelineInterruptedError.
+"""
+
+import asyncio
+import importlib
+import logging
+import pprint
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional
+
+import pandas as pd
+
+from assignment_memory import Assignment_memory
+from assignment_rules import UNKNOWN_MEMBER_KEY, Assignment_rules
+from expense import Expense
+from member_cache import Member_cache
+from parse_cache import Parse_cache
+from parse_config import ASSISTANT_PARSE_MODE
+from run_metrics import Run_metrics
+from splitwise_client import Splitwise_client, Upload_result, print_upload_summary
+from statement_pipeline import parse_statement, process_statement, stream_rows
+
+# Row batches (a chunk of pages, or a single streamed row) waiting to be processed
+ROWS_QUEUE_SIZE = 4
+# How often the parse thread, while waiting on a full queue, checks whether to stop
+STOP_POLL_SECONDS = 0.5
+
+
+@dataclass
+class Pipeline_result:
+    """Everything a pipeline run produced: the assigned rows, their expenses, and the uploads."""
+
+    name_to_id: dict
+    statement: pd.DataFrame
+    expenses: List[Expense] = field(default_factory=list)
+    # Empty unless uploading, in the order the uploads started
+    results: List[Upload_result] = field(default_factory=list)
+
+
+class PipelineInterruptedError(Exception):
+    """A stage failed. result has what the pipeline got to; the stage's error is the __cause__."""
+
+    def __init__(self, result: Pipeline_result):
+        super().__init__(f"Stopped after {len(result.results)} uploads")
+        self.result = result
+
+
+def run_pipeline(
+    args,
+    config: dict,
+    splitwise_client: Splitwise_client,
+    member_cache: Member_cache,
+    metrics: Optional[Run_metrics] = None,
+) -> Pipeline_result:
+    """Run the pipeline for args.statement_pdf. Takes the upload command's arguments."""
+
+    return asyncio.run(
+        Statement_pipeline(
+            args, config, splitwise_client, member_cache, metrics or Run_metrics()
+        ).run()
+    )
+
+
+class Statement_pipeline:
+    def __init__(
+        self,
+        args,
+        config: dict,
+        splitwise_client: Splitwise_client,
+        member_cache: Member_cache,
+        metrics: Run_metrics,
+    ):
+        self.args = args
+        self.config = config
+        self.group_id = config["group_id"]
+        self.splitwise_client = splitwise_client
+        self.member_cache = member_cache
+        self.metrics = metrics
+
+        self.rows_queue = asyncio.Queue(maxsize=ROWS_QUEUE_SIZE)
+        self.expenses_queue = asyncio.Queue(maxsize=args.queue_size)
+        self.num_writers = max(1, args.max_workers)
+
+        self.statements = []
+        self.expenses = []
+        self.uploads = []
+        self.first_upload_at = None
+        # Set once the parse thread should give up, e.g. because another stage failed
+        self.stopped = threading.Event()
+
+    async def run(self) -> Pipeline_result:
+        loop = asyncio.get_running_loop()
+        # One thread per upload worker, plus the parser's and a few for setup
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.num_writers + 4))
+
+        started_at = time.perf_counter()
+        with self.metrics.stage("pipeline.setup"):
+            await self.setup()
+
+        error = None
+        try:
+            async with asyncio.TaskGroup() as stages:
+                stages.create_task(self.produce(loop))
+                stages.create_task(self.process())
+                for _ in range(self.num_writers):
+                    stages.create_task(self.write())
+        except BaseExceptionGroup as failed:
+            # The first stage to fail; the rest were cancelled because of it
+            error = failed.exceptions[0]
+        # Uploads that were sent finish either way, so none of them go unrecorded
+        results = list(await asyncio.gather(*self.uploads))
+        if self.first_upload_at is not None:
+            self.metrics.record_stage(
+                "pipeline.upload", time.perf_counter() - self.first_upload_at
+            )
+        self.metrics.record_stage("pipeline", time.perf_counter() - started_at)
+
+        if self.args.upload_to_splitwise:
+            print_upload_summary(results)
+        else:
+            logging.info("NOT uploading to splitwise.")
+
+        statement = (
+            pd.concat(self.statements, ignore_index=True)
+            if self.statements
+            else pd.DataFrame()
+        )
+        result = Pipeline_result(self.name_to_id, statement, self.expenses, results)
+        if error is not None:
+            raise PipelineInterruptedError(result) from error
+        return result
+
+    async def setup(self):
+        args = self.args
+        needs_gpt = not (args.local_extract and args.offline)
+
+        async def fetch_members():
+            with self.metrics.stage("members"):
+                return await asyncio.to_thread(self.member_cache.get, self.group_id)
+
+        async def import_parser():
+            # Importing openai alone takes about a second
+            if needs_gpt:
+                await asyncio.to_thread(
+                    importlib.import_module, "bayclub_statement_parser"
+                )
+
+        async def load_memory():
+            if args.no_assignment_memory:
+                return None
+            return await asyncio.to_thread(Assignment_memory, args.assignment_memory)
+
+        self.name_to_id, _, memory = await asyncio.gather(
+            fetch_members(), import_parser(), load_memory()
+        )
+        self.members = [name for name in self.name_to_id if name != UNKNOWN_MEMBER_KEY]
+        self.assignment_rules = Assignment_rules(self.members)
+        self.learned = (
+            None if memory is None else memory.learned(self.group_id, self.members)
+        )
+
+        # These need the members: the cache key and the assistant's instructions name them
+        self.parse_cache = Parse_cache()
+        self.cache_key = None
+        self.cached = None
+        self.statement_parser = None
+        if args.local_extract or args.stream:
+            # Both look the cache up themselves
+            return
+
+        async def lookup_cache():
+            self.cache_key = await asyncio.to_thread(
+                self.parse_cache.key, args.statement_pdf, self.members, args.parse_mode
+            )
+            if not args.refresh_parse:
+                self.cached = await asyncio.to_thread(
+                    self.parse_cache.get, self.cache_key
+                )
+
+        async def prepare_parser():
+            from bayclub_statement_parser import Bayclub_statement_parser
+
+            self.statement_parser = Bayclub_statement_parser(
+                members=self.members, parse_mode=args.parse_mode, metrics=self.metrics
+            )
+            if args.parse_mode == ASSISTANT_PARSE_MODE:
+                # Looked up while the cache is checked; wasted only on a cache hit
+                await asyncio.to_thread(lambda: self.statement_parser.assistant)
+
+        await asyncio.gather(lookup_cache(), prepare_parser())
+
+    def row_batches(self) -> Iterator[pd.DataFrame]:
+        """The statement's rows, in batches, as they're parsed. Runs in a worker thread."""
+
+        args = self.args
+        if args.local_extract:
+            yield parse_statement(
+                args.statement_pdf,
+                self.members,
+                local_extract=True,
+                offline=args.offline,
+                metrics=self.metrics,
+                learned=self.learned,
+            )
+        elif args.stream:
+            for row in stream_rows(
+                args.statement_pdf, self.members, args.refresh_parse, self.metrics
+            ):
+                yield pd.DataFrame([row.model_dump()])
+        elif self.cached is not None:
+            logging.info("Using cached parse of this statement.")
+            yield self.cached
+        else:
+            if args.pages_per_chunk > 0:
+                chunks = self.statement_parser.iter_parse_chunks(
+                    args.statement_pdf,
+                    args.pages_per_chunk,
+                    max_workers=args.parallel_chunks,
+                )
+            else:
+                chunks = iter([self.statement_parser.parse(args.statement_pdf)])
+
+            parsed = []
+            for chunk in chunks:
+                parsed.append(chunk)
+                yield chunk
+            self.parse_cache.put(self.cache_key, pd.concat(parsed, ignore_index=True))
+            logging.info("Got parsed statement. Thank you GPT <3")
+
+    async def produce(self, loop: asyncio.AbstractEventLoop):
+        def pump(batches: Callable[[], Iterator[pd.DataFrame]]):
+            batches = batches()
+            try:
+                for batch in batches:
+                    put = asyncio.run_coroutine_threadsafe(
+                        self.rows_queue.put(batch), loop
+                    )
+                    # Blocks this thread while the queue is full
+                    while True:
+                        try:
+                            put.result(timeout=STOP_POLL_SECONDS)
+                            break
+                        except TimeoutError:
+                            if self.stopped.is_set():
+                                put.cancel()
+                                return
+                    if self.stopped.is_set():
+                        return
+            finally:
+                batches.close()
+
+        try:
+            with self.metrics.stage("pipeline.parse"):
+                await asyncio.to_thread(pump, self.row_batches)
+        finally:
+            # Also when cancelled: the thread outlives the task otherwise
+            self.stopped.set()
+        await self.rows_queue.put(None)
+
+    async def process(self):
+        while (batch := await self.rows_queue.get()) is not None:
+            started_at = time.perf_counter()
+            statement = self.assignment_rules.apply(batch)
+            if self.learned is not None:
+                statement = self.learned.apply(statement)
+            self.statements.append(statement)
+            expenses = process_statement(
+                statement.copy(),
+                self.group_id,
+                self.config["payer_name"],
+                self.name_to_id,
+                self.config.get("aliases"),
+            )
+            self.metrics.record_stage(
+                "pipeline.process", time.perf_counter() - started_at
+            )
+
+            for expense in expenses:
+                self.expenses.append(expense)
+                # Waits while the upload workers are behind
+                await self.expenses_queue.put(expense)
+
+        for _ in range(self.num_writers):
+            await self.expenses_queue.put(None)
+
+    async def write(self):
+        while (expense := await self.expenses_queue.get()) is not None:
+            if not self.args.upload_to_splitwise:
+                pprint.pprint(expense)
+                continue
+
+            if self.first_upload_at is None:
+                self.first_upload_at = time.perf_counter()
+            # Its own task, so the upload still finishes if this worker is cancelled
+            upload = asyncio.ensure_future(
+                asyncio.to_thread(self.splitwise_client.add_expense, expense)
+            )
+            self.uploads.append(upload)
+            await asyncio.shield(upload)
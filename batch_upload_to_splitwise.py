@@ -0,0 +1,268 @@
+import argparse
+import atexit
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from assignment_rules import UNKNOWN_MEMBER_KEY
+from assignment_memory import Assignment_memory
+from member_cache import Member_cache
+from parse_config import LOCAL_PARSE_MODE
+from run_metrics import Run_metrics, write_metrics
+from splitwise_client import DEFAULT_MAX_WORKERS, Splitwise_client, load_secrets
+from statement_pipeline import filter_new_expenses, parse_statement, process_statement
+from statement_store import open_statement_store
+from upload_to_splitwise import (
+    add_member_arguments,
+    add_memory_arguments,
+    add_metrics_arguments,
+    add_parse_arguments,
+    add_store_argument,
+    load_config,
+)
+
+DEFAULT_PARALLEL_STATEMENTS = 4
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Parse many bayclub statements in parallel and upload charges to splitwise"
+    )
+
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--manifest",
+        type=str,
+        help='A JSON list of {"statement_pdf": ..., "config": ...} objects. '
+        "Relative paths are resolved against the manifest's directory.",
+    )
+    source.add_argument(
+        "--statement-dir",
+        type=str,
+        help="A directory of statement PDFs. Each X.pdf uses X.json as its config if it "
+        "exists, and config.json in the same directory otherwise.",
+    )
+
+    parser.add_argument(
+        "--report-dir",
+        type=str,
+        default="reports",
+        help="Where to write one result report per statement.",
+    )
+    parser.add_argument(
+        "--parallel-statements",
+        type=int,
+        default=DEFAULT_PARALLEL_STATEMENTS,
+        help="Number of statements to parse at the same time.",
+    )
+    parser.add_argument(
+        "--upload-to-splitwise",
+        action="store_true",
+        help="Uploads to splitwise if specified",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Number of expenses to upload concurrently, per statement.",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Only upload expenses that aren't already in the Splitwise group",
+    )
+    add_member_arguments(parser)
+    add_parse_arguments(parser)
+    add_memory_arguments(parser)
+    add_store_argument(parser)
+    parser.add_argument(
+        "--no-store",
+        action="store_true",
+        help="Don't record the parsed rows in the statement store",
+    )
+    # The metrics cover all statements
+    add_metrics_arguments(parser)
+
+    return parser.parse_args()
+
+
+def load_jobs(args) -> list:
+    """Return the (statement_pdf, config_path) pairs to process."""
+
+    if args.manifest:
+        base_dir = os.path.dirname(os.path.abspath(args.manifest))
+        with open(args.manifest, "r") as file:
+            manifest = json.load(file)
+        return [
+            (
+                os.path.join(base_dir, entry["statement_pdf"]),
+                os.path.join(base_dir, entry["config"]),
+            )
+            for entry in manifest
+        ]
+
+    jobs = []
+    for statement_pdf in sorted(glob.glob(os.path.join(args.statement_dir, "*.pdf"))):
+        config_path = os.path.splitext(statement_pdf)[0] + ".json"
+        if not os.path.exists(config_path):
+            config_path = os.path.join(args.statement_dir, "config.json")
+        jobs.append((statement_pdf, config_path))
+    return jobs
+
+
+def report_name(args, statement_pdf: str) -> str:
+    """The statement's report file name: its path relative to the manifest or statement
+    directory, so same-named statements in different directories don't collide.
+    """
+
+    base_dir = (
+        os.path.dirname(os.path.abspath(args.manifest))
+        if args.manifest
+        else args.statement_dir
+    )
+    relative_path = os.path.relpath(
+        os.path.abspath(statement_pdf), os.path.abspath(base_dir)
+    )
+    name = os.path.splitext(relative_path)[0].replace(os.sep, "__")
+    return f"{name}.report.json"
+
+
+def run_job(job, args, splitwise_client, member_cache, memory, store, metrics) -> dict:
+    """Parse, process and (optionally) upload one statement. Never raises."""
+
+    statement_pdf, config_path = job
+    report = {"statement_pdf": statement_pdf, "config": config_path}
+    started_at = time.monotonic()
+
+    try:
+        config = load_config(config_path)
+        group_id = config["group_id"]
+        report["group_id"] = group_id
+
+        name_to_id = member_cache.get(group_id)
+        members = [name for name in name_to_id if name != UNKNOWN_MEMBER_KEY]
+
+        with metrics.stage("parse_statement"):
+            parsed_statement = parse_statement(
+                statement_pdf,
+                members,
+                local_extract=args.local_extract,
+                offline=args.offline,
+                refresh_parse=args.refresh_parse,
+                pages_per_chunk=args.pages_per_chunk,
+                parallel_chunks=args.parallel_chunks,
+                parse_mode=args.parse_mode,
+                metrics=metrics,
+                learned=None if memory is None else memory.learned(group_id, members),
+            )
+        report["rows"] = len(parsed_statement)
+
+        rows = None
+        if store is not None:
+            rows = store.append(
+                parsed_statement,
+                statement_pdf,
+                group_id,
+                LOCAL_PARSE_MODE if args.local_extract else args.parse_mode,
+            )
+
+        with metrics.stage("process_statement"):
+            expenses = process_statement(
+                parsed_statement,
+                group_id,
+                config["payer_name"],
+                name_to_id,
+                config.get("aliases"),
+            )
+        report["expenses"] = len(expenses)
+
+        if args.upload_to_splitwise:
+            new_expenses = expenses
+            if args.sync:
+                with metrics.stage("sync"):
+                    new_expenses = filter_new_expenses(
+                        splitwise_client, expenses, group_id
+                    )
+                report["already_uploaded"] = report["expenses"] - len(new_expenses)
+
+            with metrics.stage("upload"):
+                results = splitwise_client.add_expenses(
+                    new_expenses, max_workers=args.max_workers
+                )
+            if rows is not None:
+                store.record_uploads(rows, expenses, results)
+            report["uploaded"] = sum(result.success for result in results)
+            report["failures"] = [
+                {
+                    "description": result.expense.description,
+                    "date": result.expense.date,
+                    "error": result.error,
+                }
+                for result in results
+                if not result.success
+            ]
+        report["success"] = not report.get("failures")
+    except Exception as e:
+        logging.exception(f"Failed to process {statement_pdf}")
+        report["success"] = False
+        report["error"] = repr(e)
+
+    report["elapsed_seconds"] = round(time.monotonic() - started_at, 3)
+    return report
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Stages are summed over every statement
+    metrics = Run_metrics()
+    atexit.register(write_metrics, metrics, args.metrics_json, args.metrics_prometheus)
+
+    # One client (and one session + rate limiter) shared by every statement
+    splitwise_client = Splitwise_client(load_secrets(), metrics=metrics)
+    # Each group's members are fetched once, however many statements belong to it
+    member_cache = Member_cache(splitwise_client, ttl_seconds=args.members_ttl)
+    if args.refresh_members:
+        member_cache.invalidate()
+
+    # Shared by every statement; each one writes its own files
+    store = None if args.no_store else open_statement_store(args.store)
+    memory = (
+        None if args.no_assignment_memory else Assignment_memory(args.assignment_memory)
+    )
+
+    jobs = load_jobs(args)
+    logging.info(f"Processing {len(jobs)} statements...")
+
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel_statements)) as executor:
+        reports = list(
+            executor.map(
+                lambda job: run_job(
+                    job, args, splitwise_client, member_cache, memory, store, metrics
+                ),
+                jobs,
+            )
+        )
+
+    os.makedirs(args.report_dir, exist_ok=True)
+    for report in reports:
+        report_path = os.path.join(
+            args.report_dir, report_name(args, report["statement_pdf"])
+        )
+        with open(report_path, "w") as file:
+            json.dump(report, file, indent=4, default=str)
+
+    failed = [report for report in reports if not report["success"]]
+    print(
+        f"Processed {len(reports) - len(failed)}/{len(reports)} statements successfully."
+    )
+    for report in failed:
+        print(
+            f"FAILED: {report['statement_pdf']}: {report.get('error', 'upload failures')}"
+        )
+
+    if failed:
+        raise SystemExit(1)
@@ -1,10 +1,44 @@
+import hashlib
 import io
-from typing import List
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import Iterator, List, Optional
 
 import openai
 import pandas as pd
 from pydantic import BaseModel
 
+from assignment_rules import UNKNOWN_MEMBER_KEY
+from parse_config import (
+    ASSISTANT_PARSE_MODE,
+    DEFAULT_PAGES_PER_CHUNK,
+    DEFAULT_PARALLEL_CHUNKS,
+    DEFAULT_PARSE_MODE,
+    MODEL,
+    STRUCTURED_PARSE_MODE,
+    build_assignment_rules,
+    build_instructions,
+)
+from run_metrics import Run_metrics
+from statement_extractor import split_pdf
+
+ASSISTANT_NAME = "PDF Parser"
+ASSISTANT_TOOLS = [{"type": "file_search"}, {"type": "code_interpreter"}]
+ASSISTANT_TEMPERATURE = 0.5
+
+# Assistant metadata key holding the hash of the config the assistant was created with
+CONFIG_HASH_KEY = "config_hash"
+
+DEFAULT_CHUNK_ATTEMPTS = 3
+
+# Overrides the "offer a file" instruction, so rows can be consumed as they're generated
+STREAM_INSTRUCTIONS = """Instead of offering a file, reply with the rows directly: one JSON object
+    per line, with no surrounding array, code fences or commentary."""
+
 
 class Row(BaseModel):
     date: str
@@ -18,14 +52,14 @@ class Parsed_statement(BaseModel):
     rows: list[Row]
 
 
-# Maybe one day I'll use this:
-#             response_format={
-#               "type": "json_schema",
-#               "json_schema": {
-#                   "name": "Prased_statement",
-#                   "schema": Parsed_statement.model_json_schema(),
-#               },
-#           },
+class Assignment(BaseModel):
+    index: int
+    assigned_member: str
+    reason: str
+
+
+class Assignments(BaseModel):
+    assignments: list[Assignment]
 
 
 class MissingOutputError(Exception):
@@ -39,64 +73,369 @@ class AmbiguousOutputError(Exception):
         super().__init__(self.message)
 
 
+def parse_row_line(line: str) -> Optional[Row]:
+    """A Row from one line of streamed output, or None if the line isn't a row."""
+
+    line = line.strip().rstrip(",")
+    if not line.startswith("{"):
+        # Blank lines, code fences, array brackets, commentary
+        return None
+    try:
+        row = json.loads(line)
+        return Row.model_validate(
+            {key.lower(): str(value) for key, value in row.items()}
+        )
+    except (ValueError, AttributeError) as e:
+        logging.warning(f"Skipping unparseable row {line!r}: {e}")
+        return None
+
+
+def is_missing(value) -> bool:
+    return pd.isna(value) or not str(value).strip()
+
+
+def merge_chunks(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate per-chunk parses in page order, mending rows split across a page break.
+
+    Chunks are disjoint page ranges, so a row never appears in two of them. A row split
+    by a page break shows up as leading rows of the next chunk with no date or amount of
+    their own, and those are appended to the previous chunk's last description. Every
+    row with a date and amount is kept, even if it matches its neighbor: the same charge
+    can really be booked twice. Column names are lower-cased.
+    """
+
+    rows = []
+    for chunk in chunks:
+        chunk_rows = [
+            {str(key).lower(): value for key, value in row.items()}
+            for row in chunk.to_dict("records")
+        ]
+
+        while rows and chunk_rows:
+            last, first = rows[-1], chunk_rows[0]
+            if not (is_missing(first.get("date")) or is_missing(first.get("amount"))):
+                break
+            last["description"] = (
+                f"{last.get('description', '')} {first.get('description', '')}"
+            ).strip()
+            chunk_rows.pop(0)
+
+        rows.extend(chunk_rows)
+
+    return pd.DataFrame(rows)
+
+
 class Bayclub_statement_parser:
-    def __init__(self, members: List[str]):
+    def __init__(
+        self,
+        members: List[str],
+        parse_mode: str = DEFAULT_PARSE_MODE,
+        metrics: Optional[Run_metrics] = None,
+    ):
         self.client = openai.OpenAI()
+        self.members = members
+        self.parse_mode = parse_mode
+        self.metrics = metrics or Run_metrics()
 
-        instructions = f"""You are a helpful assistant who is proficient at parsing PDFs and processing data.
+    @cached_property
+    def assistant(self):
+        # Only needed for PDF parsing, so assigning extracted rows never pays for the lookup
+        with self.metrics.stage("openai.assistant"):
+            return self.find_or_create_assistant(build_instructions(self.members))
 
-        You will be given PDFs that represent billing statements for a group, and you are tasked with
-        processing it into a table (in JSON format).
+    def find_or_create_assistant(self, instructions: str):
+        """Reuse an assistant created with the same instructions and settings, if there is one."""
 
-        1. Use quotes to escape commas
-        2. Derive a "Responsible person" column that is either one of the members, or “All” or “Unknown”. The members are "{members}". 
-        3. Use the following keys for each row in the JSON output: “Date,Amount,Description,Assigned_member,Reason”, where reason is your rationale for how you derived the responsible person (see more about rules below).
-        4. Include the full description (e.g. merge multiple lines into one if necessary) for human consumption
-        5. Offer the result as a file to download, no need to print out the JSON as part of the conversation
+        config_hash = hashlib.sha256(
+            f"{MODEL}\n{ASSISTANT_TOOLS}\n{ASSISTANT_TEMPERATURE}\n{instructions}".encode()
+        ).hexdigest()[:32]
 
-        Here are the rules for deriving the responsible person from the row description:
-        
-        1. Dues are always “All” regardless of what name is associated with the row in the PDF.
-        2. Only parse the user name if it's not surrounded by parens. e.g. "No Show Fee (Amy Buffet) No Show Fee John Doe" should be assigned to John Doe, not Amy Buffet
-        3. ASSIGN TO THE FIRST NAME IF MULTIPLE NAMES SHOW UP regardless of case, e.g. "Court Fee 8/10 {members[0]} court time {members[1]} primary" should be assigned to "{members[0]}" instead of "{members[1]}"
-        4. If it sounds like a shared responsibility, e.g. "shared membership ..." assign it to "All"
-        5. Assign to "Unknown" if you can't figure it out.
-        6.  The first 3 are hard rules. 4 and 5 are soft and require some judgment.
+        for assistant in self.client.beta.assistants.list(limit=100):
+            if (assistant.metadata or {}).get(CONFIG_HASH_KEY) == config_hash:
+                logging.info(f"Reusing assistant {assistant.id}")
+                return assistant
 
-        Remember to think step by step, and double check your work.
-        """
-
-        self.assistant = self.client.beta.assistants.create(
-            name="PDF Parser",
+        return self.client.beta.assistants.create(
+            name=ASSISTANT_NAME,
             instructions=instructions,
-            model="gpt-4o",
-            tools=[{"type": "file_search"}, {"type": "code_interpreter"}],
-            temperature=0.5,
+            model=MODEL,
+            tools=ASSISTANT_TOOLS,
+            temperature=ASSISTANT_TEMPERATURE,
+            metadata={CONFIG_HASH_KEY: config_hash},
         )
 
-    def upload_and_parse(self, file_path):
-        message_file = self.client.files.create(
-            file=open(file_path, "rb"), purpose="assistants"
-        )
+    def assign_members(self, descriptions: List[str]) -> List[Assignment]:
+        """Ask GPT to assign already-extracted row descriptions, without uploading the PDF.
+
+        Returns one Assignment per description, in order.
+        """
+
+        if not descriptions:
+            return []
+
+        rows = [
+            {"index": index, "description": description}
+            for index, description in enumerate(descriptions)
+        ]
+        with self.metrics.stage("openai.assign"):
+            completion = self.client.chat.completions.parse(
+                model=MODEL,
+                temperature=ASSISTANT_TEMPERATURE,
+                response_format=Assignments,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": f"""You assign rows of a group's billing statement to the member responsible for them.
+    The responsible person is either one of the members, or “All” or “Unknown”. The members are "{self.members}".
+
+    {build_assignment_rules(self.members)}
+    Return exactly one assignment per row, using the row's index.""",
+                    },
+                    {"role": "user", "content": json.dumps(rows)},
+                ],
+            )
+        self.metrics.record_usage(MODEL, completion.usage)
+
+        by_index = {
+            assignment.index: assignment
+            for assignment in completion.choices[0].message.parsed.assignments
+        }
+        return [
+            by_index.get(
+                index,
+                Assignment(
+                    index=index,
+                    assigned_member=UNKNOWN_MEMBER_KEY,
+                    reason="GPT skipped this row",
+                ),
+            )
+            for index in range(len(descriptions))
+        ]
+
+    def parse(self, file_path) -> pd.DataFrame:
+        """Parse a statement PDF with this parser's parse mode."""
+
+        if self.parse_mode == STRUCTURED_PARSE_MODE:
+            return self.parse_structured(file_path)
+        return self.upload_and_parse(file_path)
 
-        thread = self.client.beta.threads.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": "Please parse this PDF and offer a link to download the JSON.",
-                    "attachments": [
-                        {"file_id": message_file.id, "tools": [{"type": "file_search"}]}
+    def parse_structured(self, file_path) -> pd.DataFrame:
+        """Parse the PDF in one chat completion whose response must match Parsed_statement.
+
+        No assistant, thread, tool run or output file is involved.
+        """
+
+        with self.metrics.stage("openai.upload"), open(file_path, "rb") as file:
+            uploaded_file = self.client.files.create(file=file, purpose="user_data")
+
+        try:
+            with self.metrics.stage("openai.completion"):
+                completion = self.client.chat.completions.parse(
+                    model=MODEL,
+                    temperature=ASSISTANT_TEMPERATURE,
+                    response_format=Parsed_statement,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": build_instructions(
+                                self.members, STRUCTURED_PARSE_MODE
+                            ),
+                        },
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "file", "file": {"file_id": uploaded_file.id}},
+                                {"type": "text", "text": "Please parse this PDF."},
+                            ],
+                        },
                     ],
-                }
-            ]
+                )
+            self.metrics.record_usage(MODEL, completion.usage)
+        finally:
+            with self.metrics.stage("openai.cleanup"):
+                self._delete_file(uploaded_file.id)
+
+        message = completion.choices[0].message
+        if message.parsed is None:
+            raise MissingOutputError(message.refusal or "The response had no rows")
+
+        return pd.DataFrame(
+            [row.model_dump() for row in message.parsed.rows],
+            columns=list(Row.model_fields),
         )
 
-        print("querying GPT. This may take a while...")
+    def upload_and_parse(self, file_path):
+        with self.metrics.stage("openai.upload"), open(file_path, "rb") as file:
+            message_file = self.client.files.create(file=file, purpose="assistants")
+
+        thread = None
+        try:
+            thread = self.client.beta.threads.create(
+                messages=[
+                    {
+                        "role": "user",
+                        "content": "Please parse this PDF and offer a link to download the JSON.",
+                        "attachments": [
+                            {
+                                "file_id": message_file.id,
+                                "tools": [{"type": "file_search"}],
+                            }
+                        ],
+                    }
+                ]
+            )
+
+            print("querying GPT. This may take a while...")
 
-        run = self.client.beta.threads.runs.create_and_poll(
-            thread_id=thread.id, assistant_id=self.assistant.id, poll_interval_ms=1000
+            assistant = self.assistant
+            with self.metrics.stage("openai.run"):
+                run = self.client.beta.threads.runs.create_and_poll(
+                    thread_id=thread.id,
+                    assistant_id=assistant.id,
+                    poll_interval_ms=1000,
+                )
+            self.metrics.record_usage(MODEL, run.usage)
+
+            with self.metrics.stage("openai.download"):
+                return self._download_output(thread, run)
+        finally:
+            with self.metrics.stage("openai.cleanup"):
+                self._cleanup(thread, message_file.id)
+
+    def parse_in_chunks(
+        self,
+        file_path,
+        pages_per_chunk: int = DEFAULT_PAGES_PER_CHUNK,
+        max_workers: int = DEFAULT_PARALLEL_CHUNKS,
+        max_attempts: int = DEFAULT_CHUNK_ATTEMPTS,
+    ) -> pd.DataFrame:
+        """Parse the PDF a few pages at a time, concurrently, and merge the rows in order.
+
+        A chunk that fails is retried on its own, up to max_attempts times.
+        """
+
+        chunks = list(
+            self.iter_parse_chunks(
+                file_path, pages_per_chunk, max_workers, max_attempts
+            )
         )
+        if len(chunks) == 1:
+            return chunks[0]
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+    def iter_parse_chunks(
+        self,
+        file_path,
+        pages_per_chunk: int = DEFAULT_PAGES_PER_CHUNK,
+        max_workers: int = DEFAULT_PARALLEL_CHUNKS,
+        max_attempts: int = DEFAULT_CHUNK_ATTEMPTS,
+    ) -> Iterator[pd.DataFrame]:
+        """Like parse_in_chunks, but yields the merged rows in page order as chunks finish.
+
+        Each chunk's last row is held back until the next chunk has been merged into it,
+        so the concatenated output is the same as parse_in_chunks'.
+        """
 
+        if self.parse_mode == ASSISTANT_PARSE_MODE:
+            # Resolve the assistant once, before the workers race to create it
+            self.assistant
+
+        with tempfile.TemporaryDirectory() as chunk_dir:
+            chunk_paths = split_pdf(file_path, pages_per_chunk, chunk_dir)
+            if len(chunk_paths) == 1:
+                yield self.parse(file_path)
+                return
+
+            print(
+                f"querying GPT about {len(chunk_paths)} chunks of {pages_per_chunk} page(s)..."
+            )
+            tail = []
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                # map() yields in page order, each chunk as soon as it and those before it are done
+                for chunk in executor.map(
+                    lambda chunk_path: self._parse_chunk(chunk_path, max_attempts),
+                    chunk_paths,
+                ):
+                    merged = merge_chunks([pd.DataFrame(tail), chunk])
+                    tail = merged.iloc[-1:].to_dict("records")
+                    if len(merged) > 1:
+                        yield merged.iloc[:-1].reset_index(drop=True)
+
+        if tail:
+            yield pd.DataFrame(tail)
+
+    def _parse_chunk(self, chunk_path, max_attempts: int) -> pd.DataFrame:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                return self.parse(chunk_path)
+            except (
+                openai.OpenAIError,
+                MissingOutputError,
+                AmbiguousOutputError,
+                ValueError,
+            ) as e:
+                if attempt == max_attempts:
+                    raise
+                logging.warning(
+                    f"Parsing {os.path.basename(chunk_path)} failed (attempt {attempt}/{max_attempts}), retrying: {e}"
+                )
+
+    def iter_parse(self, file_path) -> Iterator[Row]:
+        """Like upload_and_parse, but streams the run and yields each Row as soon as it's complete.
+
+        Lines that don't parse as a row are logged and skipped.
+        """
+
+        with self.metrics.stage("openai.upload"), open(file_path, "rb") as file:
+            message_file = self.client.files.create(file=file, purpose="assistants")
+
+        thread = None
+        try:
+            thread = self.client.beta.threads.create(
+                messages=[
+                    {
+                        "role": "user",
+                        "content": "Please parse this PDF.",
+                        "attachments": [
+                            {
+                                "file_id": message_file.id,
+                                "tools": [{"type": "file_search"}],
+                            }
+                        ],
+                    }
+                ]
+            )
+
+            assistant = self.assistant
+            with self.client.beta.threads.runs.stream(
+                thread_id=thread.id,
+                assistant_id=assistant.id,
+                additional_instructions=STREAM_INSTRUCTIONS,
+                # No code interpreter, so the model writes the rows instead of a file
+                tools=[{"type": "file_search"}],
+            ) as stream:
+                buffer = ""
+                for event in stream:
+                    if event.event == "thread.run.completed":
+                        self.metrics.record_usage(MODEL, event.data.usage)
+                    if event.event != "thread.message.delta":
+                        continue
+                    for block in event.data.delta.content or []:
+                        if block.type == "text" and block.text and block.text.value:
+                            buffer += block.text.value
+
+                    *lines, buffer = buffer.split("\n")
+                    for line in lines:
+                        if row := parse_row_line(line):
+                            yield row
+
+                if row := parse_row_line(buffer):
+                    yield row
+        finally:
+            with self.metrics.stage("openai.cleanup"):
+                self._cleanup(thread, message_file.id)
+
+    def _download_output(self, thread, run):
         messages = list(
             self.client.beta.threads.messages.list(thread_id=thread.id, run_id=run.id)
         )
@@ -119,5 +458,34 @@ class Bayclub_statement_parser:
             print(message_content)
             raise AmbiguousOutputError(output_files)
 
-        file_contents = self.client.files.content(output_files[0].file_id)
+        output_file_id = output_files[0].file_id
+        try:
+            file_contents = self.client.files.content(output_file_id)
+        finally:
+            self._delete_file(output_file_id)
         return pd.read_json(io.BytesIO(file_contents.content))
+
+    def _cleanup(self, thread, uploaded_file_id):
+        """Delete everything a parse created: the thread, its vector store and the uploaded PDF."""
+
+        if thread is not None:
+            file_search = getattr(thread.tool_resources, "file_search", None)
+            for vector_store_id in getattr(file_search, "vector_store_ids", None) or []:
+                try:
+                    self.client.vector_stores.delete(vector_store_id)
+                except openai.OpenAIError as e:
+                    logging.warning(
+                        f"Failed to delete vector store {vector_store_id}: {e}"
+                    )
+            try:
+                self.client.beta.threads.delete(thread.id)
+            except openai.OpenAIError as e:
+                logging.warning(f"Failed to delete thread {thread.id}: {e}")
+
+        self._delete_file(uploaded_file_id)
+
+    def _delete_file(self, file_id):
+        try:
+            self.client.files.delete(file_id)
+        except openai.OpenAIError as e:
+            logging.warning(f"Failed to delete file {file_id}: {e}")
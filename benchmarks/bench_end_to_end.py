@@ -0,0 +1,156 @@
+"""Wall time of a whole upload_to_splitwise.py run against local fakes of Splitwise and OpenAI.
+
+Run from the repo root:
+
+    python3 benchmarks/bench_end_to_end.py --rows 50 200 --latency 0.05
+    python3 benchmarks/bench_end_to_end.py --parse-mode assistant --stream
+    python3 benchmarks/bench_end_to_end.py --pipeline --latency 0.05
+
+Each run is a fresh process in a scratch directory (so nothing is cached), parsing a
+one-page statement for which the fake OpenAI returns --rows rows, and uploading them.
+The run's own --metrics-json report gives the per-stage breakdown. Add --record to
+append the results to benchmarks/results.jsonl.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from fake_servers import (  # noqa: E402
+    GROUP_ID,
+    Fake_openai_handler,
+    Fake_splitwise_handler,
+    add_fault_arguments,
+    fake_rows,
+    faults_from_args,
+    openai_url,
+    serve,
+    splitwise_url,
+)
+from results import record  # noqa: E402
+
+SECRETS = {
+    "consumer_key": "fake",
+    "consumer_secret": "fake",
+    "access_token": "fake",
+    "access_token_secret": "fake",
+}
+
+
+def write_scratch_files(scratch_dir: str) -> str:
+    """Write secrets, a config and a one-page PDF. Returns the PDF's path."""
+
+    from pypdf import PdfWriter
+
+    with open(os.path.join(scratch_dir, "secrets.json"), "w") as file:
+        json.dump(SECRETS, file)
+    with open(os.path.join(scratch_dir, "config.json"), "w") as file:
+        json.dump({"group_id": GROUP_ID, "payer_name": "John Doe"}, file)
+
+    statement_pdf = os.path.join(scratch_dir, "statement.pdf")
+    writer = PdfWriter()
+    writer.add_blank_page(612, 792)
+    with open(statement_pdf, "wb") as file:
+        writer.write(file)
+    return statement_pdf
+
+
+def run_once(args, num_rows: int) -> dict:
+    faults = faults_from_args(args)
+    splitwise = serve(Fake_splitwise_handler, faults)
+    fake_openai = serve(
+        Fake_openai_handler, faults, rows=fake_rows(num_rows, args.seed)
+    )
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        statement_pdf = write_scratch_files(scratch_dir)
+        metrics_path = os.path.join(scratch_dir, "metrics.json")
+        command = [
+            sys.executable,
+            os.path.join(REPO_DIR, "upload_to_splitwise.py"),
+            "--config=config.json",
+            f"--statement-pdf={statement_pdf}",
+            "--upload-to-splitwise",
+            f"--max-workers={args.max_workers}",
+            f"--parse-mode={args.parse_mode}",
+            f"--metrics-json={metrics_path}",
+        ]
+        if args.stream:
+            command.append("--stream")
+        if args.pipeline:
+            command.append("--pipeline")
+        env = {
+            **os.environ,
+            "SPLITWISE_BASE_URL": splitwise_url(splitwise),
+            "OPENAI_BASE_URL": openai_url(fake_openai),
+            "OPENAI_API_KEY": "fake",
+        }
+
+        started_at = time.perf_counter()
+        completed = subprocess.run(
+            command, cwd=scratch_dir, env=env, capture_output=True, text=True
+        )
+        elapsed = time.perf_counter() - started_at
+
+        if completed.returncode != 0:
+            print(completed.stdout[-2000:])
+            print(completed.stderr[-2000:])
+        with open(metrics_path, "r") as file:
+            metrics = json.load(file)
+
+    splitwise.shutdown()
+    fake_openai.shutdown()
+
+    measurements = {"seconds": elapsed, "exit_code": completed.returncode}
+    for stage, timing in metrics["stages"].items():
+        measurements[f"{stage}_seconds"] = timing["seconds"]
+    measurements["splitwise_requests"] = sum(call["count"] for call in metrics["http"])
+    return measurements
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[50, 200])
+    parser.add_argument(
+        "--parse-mode", choices=["structured", "assistant"], default="structured"
+    )
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--pipeline", action="store_true")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--record", action="store_true")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    for num_rows in args.rows:
+        measurements = run_once(args, num_rows)
+        stages = ", ".join(
+            f"{key[: -len('_seconds')]} {value:.2f}s"
+            for key, value in measurements.items()
+            if key.endswith("_seconds")
+        )
+        print(
+            f"{num_rows:>6} rows: {measurements['seconds']:7.2f}s "
+            f"(exit {measurements['exit_code']}; {stages})"
+        )
+
+        if args.record:
+            params = {
+                "rows": num_rows,
+                "parse_mode": args.parse_mode,
+                "stream": args.stream,
+                "pipeline": args.pipeline,
+                "max_workers": args.max_workers,
+                "latency": args.latency,
+                "error_rate": args.error_rate,
+                "rate_limit_rate": args.rate_limit_rate,
+            }
+            for line in record("end_to_end", params, measurements):
+                print(line)
@@ -0,0 +1,186 @@
+"""Throughput of process_statement on synthetic statements.
+
+Run from the repo root:
+
+    python3 benchmarks/bench_process_statement.py --rows 10000 100000 1000000
+
+For row counts up to --reference-max-rows, the output is also checked against a
+row-by-row reference implementation, which is timed alongside for comparison, and against
+process_rows, preview's pandas-free path. Add
+--record to append the results to benchmarks/results.jsonl.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expense import Expense  # noqa: E402
+from results import record  # noqa: E402
+from statement_pipeline import (  # noqa: E402
+    ALL_MEMBERS_KEY,
+    UNKNOWN_MEMBER_KEY,
+    process_statement,
+)
+from statement_rows import process_rows  # noqa: E402
+
+NAME_TO_ID = {
+    "John Doe": 1,
+    "Jane Smith": 2,
+    "Amy Buffet": 3,
+    "Bob Lee": 4,
+    UNKNOWN_MEMBER_KEY: 5,
+}
+PAYER_NAME = "John Doe"
+GROUP_ID = "12345"
+
+
+def make_statement(num_rows: int, seed: int = 0) -> pd.DataFrame:
+    """A statement with a realistic mix of dues, individual charges and bad rows."""
+
+    rng = np.random.default_rng(seed)
+    members = list(NAME_TO_ID) + [ALL_MEMBERS_KEY] * 2 + ["Not A Member"]
+    dates = pd.Timestamp("2024-01-01") + pd.to_timedelta(
+        rng.integers(0, 365, num_rows), unit="D"
+    )
+    amounts = rng.integers(-2000, 200000, num_rows) / 100
+
+    return pd.DataFrame(
+        {
+            "Date": dates.strftime("%m/%d/%Y"),
+            "Amount": [f"{amount:,.2f}" for amount in amounts],
+            "Description": [f"Court Fee {i}" for i in range(num_rows)],
+            "Assigned_member": rng.choice(members, num_rows),
+            "Reason": "synthetic",
+        }
+    )
+
+
+def process_statement_iterrows(statement, group_id, payer_name, name_to_id) -> list:
+    """A straightforward iterrows implementation of the same rules, kept as a reference."""
+
+    payer_user_id = name_to_id.get(payer_name)
+
+    statement.columns = statement.columns.str.lower()
+    if not pd.api.types.is_numeric_dtype(statement["amount"]):
+        statement["amount"] = pd.to_numeric(
+            statement["amount"].str.replace(",", ""), errors="coerce"
+        )
+
+    expenses = []
+    for _, row in statement.iterrows():
+        cost = row.amount
+        details = row.reason
+
+        if pd.isna(cost) or cost <= 0:
+            continue
+
+        try:
+            date_str = pd.to_datetime(row.date).strftime("%Y-%m-%d")
+        except (ValueError, TypeError):
+            continue
+
+        if row.assigned_member == ALL_MEMBERS_KEY:
+            actual_members = {
+                k: v for k, v in name_to_id.items() if k != UNKNOWN_MEMBER_KEY
+            }
+            num_members = len(actual_members)
+
+            # Largest remainder with equal weights: the first members get the extra cents
+            cost_cents = round(cost * 100)
+            base, extra = divmod(cost_cents, num_members)
+            owed = (base + 1,) * extra + (base,) * (num_members - extra)
+            user_ids = tuple(actual_members.values())
+            paid = tuple(
+                cost_cents if name == payer_name else 0 for name in actual_members
+            )
+        else:
+            other_member_id = name_to_id.get(row.assigned_member)
+            if not other_member_id:
+                continue
+
+            cost_cents = round(cost * 100)
+            if other_member_id == payer_user_id:
+                user_ids, paid, owed = (payer_user_id,), (cost_cents,), (cost_cents,)
+            else:
+                user_ids = (payer_user_id, other_member_id)
+                paid, owed = (cost_cents, 0), (0, cost_cents)
+
+        expenses.append(
+            Expense(
+                cost_cents,
+                row.description,
+                date_str,
+                group_id,
+                user_ids,
+                paid,
+                owed,
+                details,
+            )
+        )
+
+    return expenses
+
+
+def process_statement_rows(statement, group_id, payer_name, name_to_id) -> list:
+    """process_rows on the statement's rows, as preview reads them from a JSON or CSV."""
+
+    statement.columns = statement.columns.str.lower()
+    return process_rows(statement.to_dict("records"), group_id, payer_name, name_to_id)
+
+
+def time_call(function, statement) -> tuple:
+    started_at = time.perf_counter()
+    expenses = function(statement.copy(), GROUP_ID, PAYER_NAME, NAME_TO_ID)
+    return time.perf_counter() - started_at, expenses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--reference-max-rows", type=int, default=100_000)
+    parser.add_argument("--record", action="store_true")
+    args = parser.parse_args()
+
+    # Bad rows are logged one by one; that's not what we're measuring
+    logging.disable(logging.CRITICAL)
+
+    for num_rows in args.rows:
+        statement = make_statement(num_rows)
+        elapsed, expenses = time_call(process_statement, statement)
+        line = (
+            f"{num_rows:>9} rows: {elapsed:8.3f}s ({num_rows / elapsed:>12,.0f} rows/s)"
+        )
+
+        if num_rows <= args.reference_max_rows:
+            reference_elapsed, reference = time_call(
+                process_statement_iterrows, statement
+            )
+            assert expenses == reference, "output differs from the reference"
+            line += f"  iterrows: {reference_elapsed:8.3f}s ({reference_elapsed / elapsed:.0f}x slower)"
+
+            rows_elapsed, rows_expenses = time_call(process_statement_rows, statement)
+            assert (
+                rows_expenses == expenses
+            ), "process_rows differs from process_statement"
+            line += f"  process_rows: {rows_elapsed:8.3f}s"
+
+        print(line)
+
+        if args.record:
+            measurements = {"seconds": elapsed, "rows_per_second": num_rows / elapsed}
+            for comparison in record(
+                "process_statement",
+                {"rows": num_rows},
+                measurements,
+                higher_is_better={"rows_per_second"},
+            ):
+                print(comparison)
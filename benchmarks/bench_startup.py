@@ -0,0 +1,143 @@
+"""Startup time of the quick upload_to_splitwise.py subcommands, against a budget.
+
+Run from the repo root:
+
+    python3 benchmarks/bench_startup.py --repeats 5
+
+Times `--help`, `validate-config` and `preview` (of a parsed JSON statement, against a
+local fake Splitwise) in fresh processes, and checks with `python -X importtime` that
+none of them import openai, pypdf or pandas. Exits non-zero if a command is over its
+budget or imports one of those, so it can gate CI. Add --record to append the results to benchmarks/results.jsonl.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from bench_end_to_end import SECRETS  # noqa: E402
+from fake_servers import (  # noqa: E402
+    GROUP_ID,
+    Fake_splitwise_handler,
+    fake_rows,
+    serve,
+    splitwise_url,
+)
+from results import record  # noqa: E402
+
+# Median wall time (seconds) each command should start, run and exit within
+BUDGETS = {
+    "help": 0.5,
+    "validate_config": 0.5,
+    "preview": 1.0,
+}
+
+# Modules none of these commands should pay for
+HEAVY_MODULES = ["openai", "pypdf", "pandas"]
+
+
+def write_scratch_files(scratch_dir: str):
+    with open(os.path.join(scratch_dir, "secrets.json"), "w") as file:
+        json.dump(SECRETS, file)
+    with open(os.path.join(scratch_dir, "config.json"), "w") as file:
+        json.dump({"group_id": GROUP_ID, "payer_name": "John Doe"}, file)
+    with open(os.path.join(scratch_dir, "statement.json"), "w") as file:
+        json.dump(fake_rows(20), file)
+
+
+def commands() -> dict:
+    script = os.path.join(REPO_DIR, "upload_to_splitwise.py")
+    return {
+        "help": [script, "--help"],
+        "validate_config": [script, "validate-config", "--config=config.json"],
+        # --refresh-members, so every run fetches from the fake instead of the cache
+        "preview": [
+            script,
+            "preview",
+            "--config=config.json",
+            "--statement=statement.json",
+            "--refresh-members",
+        ],
+    }
+
+
+def imported_modules(importtime_output: str) -> set:
+    """Top-level module names from `python -X importtime` output."""
+
+    modules = set()
+    for line in importtime_output.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return modules
+
+
+def time_command(command: list, scratch_dir: str, env: dict, repeats: int) -> tuple:
+    seconds = []
+    for _ in range(repeats):
+        started_at = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, *command], cwd=scratch_dir, env=env, capture_output=True
+        )
+        seconds.append(time.perf_counter() - started_at)
+        if completed.returncode != 0:
+            raise RuntimeError(
+                f"{command} exited with {completed.returncode}: "
+                f"{completed.stderr.decode()[-2000:]}"
+            )
+
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", *command],
+        cwd=scratch_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    heavy = sorted(set(HEAVY_MODULES) & imported_modules(completed.stderr))
+    return {"seconds": statistics.median(seconds), "min_seconds": min(seconds)}, heavy
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--record", action="store_true")
+    args = parser.parse_args()
+
+    splitwise = serve(Fake_splitwise_handler)
+    env = {**os.environ, "SPLITWISE_BASE_URL": splitwise_url(splitwise)}
+
+    failed = False
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        write_scratch_files(scratch_dir)
+        for name, command in commands().items():
+            measurements, heavy = time_command(command, scratch_dir, env, args.repeats)
+            over_budget = measurements["seconds"] > BUDGETS[name]
+            failed = failed or over_budget or bool(heavy)
+
+            problems = []
+            if over_budget:
+                problems.append(f"OVER BUDGET of {BUDGETS[name]:.2f}s")
+            if heavy:
+                problems.append(f"imports {', '.join(heavy)}")
+            print(
+                f"{name:>16}: {measurements['seconds']:6.3f}s median, "
+                f"{measurements['min_seconds']:6.3f}s min"
+                + (f"  {'; '.join(problems)}" if problems else "")
+            )
+
+            if args.record:
+                for line in record(
+                    "startup", {"command": name, "repeats": args.repeats}, measurements
+                ):
+                    print(line)
+
+    splitwise.shutdown()
+    if failed:
+        raise SystemExit(1)
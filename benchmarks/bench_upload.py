@@ -0,0 +1,115 @@
+"""Upload throughput of Splitwise_client.add_expenses against a local fake Splitwise.
+
+Run from the repo root:
+
+    python3 benchmarks/bench_upload.py --expenses 200 --max-workers 1 8 32 --latency 0.05
+
+Add --error-rate / --rate-limit-rate to see how retries and failures affect throughput,
+and --record to append the results to benchmarks/results.jsonl (and compare them with
+the last recorded run).
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expense import Expense  # noqa: E402
+from fake_servers import (  # noqa: E402
+    GROUP_ID,
+    Fake_splitwise_handler,
+    add_fault_arguments,
+    faults_from_args,
+    serve,
+    splitwise_url,
+)
+from results import record  # noqa: E402
+from splitwise_client import Splitwise_client  # noqa: E402
+
+SECRETS = {
+    "consumer_key": "fake",
+    "consumer_secret": "fake",
+    "access_token": "fake",
+    "access_token_secret": "fake",
+}
+
+
+def make_expenses(num_expenses: int) -> list:
+    return [
+        Expense(
+            1000 + index,
+            f"Court Fee {index}",
+            "2024-01-01",
+            str(GROUP_ID),
+            (1, 2),
+            (1000 + index, 0),
+            (0, 1000 + index),
+            "benchmark",
+        )
+        for index in range(num_expenses)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--expenses", type=int, default=200)
+    parser.add_argument("--max-workers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--requests-per-second",
+        type=float,
+        default=1000,
+        help="The client's rate limit. High by default, so the fake's latency is measured.",
+    )
+    parser.add_argument("--record", action="store_true")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(Fake_splitwise_handler, faults_from_args(args))
+    expenses = make_expenses(args.expenses)
+
+    for max_workers in args.max_workers:
+        client = Splitwise_client(
+            SECRETS,
+            base_url=splitwise_url(server),
+            requests_per_second=args.requests_per_second,
+        )
+
+        started_at = time.perf_counter()
+        # add_expenses prints a line per expense
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = client.add_expenses(expenses, max_workers=max_workers)
+        elapsed = time.perf_counter() - started_at
+
+        report = client.metrics.report()
+        attempts = sum(call["count"] for call in report["http"])
+        measurements = {
+            "seconds": elapsed,
+            "expenses_per_second": len(expenses) / elapsed,
+            "failed": sum(not result.success for result in results),
+            "http_attempts": attempts,
+        }
+        print(
+            f"max_workers={max_workers:>3}: {elapsed:7.3f}s "
+            f"({measurements['expenses_per_second']:8.1f} expenses/s, "
+            f"{attempts} requests, {measurements['failed']} failed)"
+        )
+
+        if args.record:
+            params = {
+                "expenses": args.expenses,
+                "max_workers": max_workers,
+                "requests_per_second": args.requests_per_second,
+                "latency": args.latency,
+                "error_rate": args.error_rate,
+                "rate_limit_rate": args.rate_limit_rate,
+            }
+            for line in record(
+                "upload", params, measurements, higher_is_better={"expenses_per_second"}
+            ):
+                print(line)
+
+    server.shutdown()
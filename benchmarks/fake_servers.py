@@ -0,0 +1,443 @@
+"""Local stand-ins for the Splitwise v3.0 and OpenAI APIs, for benchmarks.
+
+Run from the repo root to serve both until interrupted:
+
+    python3 benchmarks/fake_servers.py --latency 0.05 --error-rate 0.01 --rate-limit-rate 0.05
+
+Point Splitwise_client at the Splitwise URL with SPLITWISE_BASE_URL, and the openai SDK at
+the OpenAI URL with OPENAI_BASE_URL (and any OPENAI_API_KEY).
+
+Every request waits `latency` seconds, then fails with a 500 with probability
+`error_rate`, or with a 429 (and a Retry-After) with probability `rate_limit_rate`.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+
+GROUP_ID = 12345
+PAYER_ID = 1
+# Splitwise shows its placeholder member as "Unknown None"
+MEMBERS = [
+    (1, "John", "Doe"),
+    (2, "Jane", "Smith"),
+    (3, "Amy", "Buffet"),
+    (4, "Bob", "Lee"),
+    (5, "Unknown", None),
+]
+
+
+@dataclass
+class Faults:
+    latency: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 0.1
+    seed: int = 0
+    rng: random.Random = field(init=False)
+
+    def __post_init__(self):
+        self.rng = random.Random(self.seed)
+
+
+def fake_rows(num_rows: int, seed: int = 0) -> List[dict]:
+    """Statement rows, as GPT would return them, assigned to the fake group's members."""
+
+    rng = random.Random(seed)
+    names = [f"{first} {last}" for _, first, last in MEMBERS if last] + ["All"]
+    rows = []
+    for index in range(num_rows):
+        member = rng.choice(names)
+        description = (
+            f"Monthly Dues {index}" if member == "All" else f"Court Fee {member}"
+        )
+        rows.append(
+            {
+                "Date": f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/2024",
+                "Amount": f"{rng.randint(100, 50000) / 100:.2f}",
+                "Description": description,
+                "Assigned_member": member,
+                "Reason": "synthetic",
+            }
+        )
+    return rows
+
+
+class Fake_handler(BaseHTTPRequestHandler):
+    """Routes requests to `route_<method>` and injects the server's faults first."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        faults = self.server.faults
+        if faults.latency:
+            time.sleep(faults.latency)
+        with self.server.lock:
+            draw = faults.rng.random()
+        if draw < faults.error_rate:
+            return self.send_json({"error": "injected failure"}, status=500)
+        if draw < faults.error_rate + faults.rate_limit_rate:
+            return self.send_json(
+                {"error": "injected rate limit"},
+                status=429,
+                headers={"Retry-After": str(faults.retry_after)},
+            )
+
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        getattr(self, f"route_{method}")(url.path, query, body)
+
+    def do_GET(self):
+        self._handle("get")
+
+    def do_POST(self):
+        self._handle("post")
+
+    def do_DELETE(self):
+        self._handle("delete")
+
+    def send_json(self, payload, status=200, headers=None):
+        self.send_bytes(
+            json.dumps(payload).encode(), "application/json", status, headers
+        )
+
+    def send_bytes(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_found(self):
+        self.send_json({"error": f"no route for {self.command} {self.path}"}, 404)
+
+
+class Fake_splitwise_handler(Fake_handler):
+    def route_get(self, path, query, body):
+        state = self.server.state
+        if re.fullmatch(r".*/get_group/\d+", path):
+            members = [
+                {"id": user_id, "first_name": first, "last_name": last}
+                for user_id, first, last in MEMBERS
+            ]
+            return self.send_json({"group": {"id": GROUP_ID, "members": members}})
+        if path.endswith("/get_current_user"):
+            return self.send_json({"user": {"id": PAYER_ID, "first_name": "John"}})
+        if path.endswith("/get_friends"):
+            return self.send_json(
+                {"friends": [{"id": user_id} for user_id, _, _ in MEMBERS[1:]]}
+            )
+        if path.endswith("/get_expenses"):
+            offset = int(query.get("offset", 0))
+            limit = int(query.get("limit", 20))
+            with self.server.lock:
+                expenses = list(state["expenses"].values())
+            return self.send_json({"expenses": expenses[offset : offset + limit]})
+        self.not_found()
+
+    def route_post(self, path, query, body):
+        state = self.server.state
+        if path.endswith("/create_expense"):
+            form = {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+            users = []
+            for index in itertools.count():
+                if f"users__{index}__user_id" not in form:
+                    break
+                users.append(
+                    {
+                        "user_id": int(form[f"users__{index}__user_id"]),
+                        "paid_share": form[f"users__{index}__paid_share"],
+                        "owed_share": form[f"users__{index}__owed_share"],
+                    }
+                )
+            with self.server.lock:
+                expense_id = next(state["ids"])
+                expense = {
+                    "id": expense_id,
+                    "cost": form.get("cost"),
+                    "description": form.get("description", ""),
+                    "date": f"{form.get('date')}T00:00:00Z",
+                    "group_id": int(form.get("group_id", GROUP_ID)),
+                    "created_by": {"id": PAYER_ID},
+                    "deleted_at": None,
+                    "users": users,
+                }
+                state["expenses"][expense_id] = expense
+            return self.send_json({"expenses": [expense], "errors": {}})
+        if match := re.fullmatch(r".*/delete_expense/(\d+)", path):
+            with self.server.lock:
+                state["expenses"].pop(int(match.group(1)), None)
+            return self.send_json({"success": True, "errors": {}})
+        self.not_found()
+
+
+class Fake_openai_handler(Fake_handler):
+    """Just enough of files, assistants, threads/runs (polled or streamed) and chat completions."""
+
+    def _new_id(self, prefix):
+        with self.server.lock:
+            return f"{prefix}_{next(self.server.state['ids'])}"
+
+    def _usage(self):
+        return {"prompt_tokens": 1500, "completion_tokens": 40 * len(self.server.rows)}
+
+    def route_get(self, path, query, body):
+        state = self.server.state
+        if path.endswith("/assistants"):
+            return self.send_json(
+                {"object": "list", "data": state["assistants"], "has_more": False}
+            )
+        if match := re.fullmatch(r".*/files/([^/]+)/content", path):
+            return self.send_bytes(
+                json.dumps(self.server.rows).encode(), "application/json"
+            )
+        if match := re.fullmatch(r".*/threads/([^/]+)/runs/([^/]+)", path):
+            return self.send_json(self._run(match.group(1), match.group(2)))
+        if match := re.fullmatch(r".*/threads/([^/]+)/messages", path):
+            output_file_id = self._new_id("file")
+            text = {
+                "value": "Here is the JSON.",
+                "annotations": [
+                    {
+                        "type": "file_path",
+                        "text": "sandbox:/mnt/data/statement.json",
+                        "file_path": {"file_id": output_file_id},
+                        "start_index": 0,
+                        "end_index": 0,
+                    }
+                ],
+            }
+            message = {
+                "id": self._new_id("msg"),
+                "object": "thread.message",
+                "thread_id": match.group(1),
+                "role": "assistant",
+                "content": [{"type": "text", "text": text}],
+            }
+            return self.send_json(
+                {"object": "list", "data": [message], "has_more": False}
+            )
+        self.not_found()
+
+    def route_post(self, path, query, body):
+        state = self.server.state
+        if path.endswith("/files"):
+            return self.send_json(
+                {"id": self._new_id("file"), "object": "file", "purpose": "assistants"}
+            )
+        if path.endswith("/assistants"):
+            request = json.loads(body)
+            assistant = {"id": self._new_id("asst"), "object": "assistant", **request}
+            with self.server.lock:
+                state["assistants"].append(assistant)
+            return self.send_json(assistant)
+        if path.endswith("/threads"):
+            return self.send_json(
+                {
+                    "id": self._new_id("thread"),
+                    "object": "thread",
+                    "tool_resources": {
+                        "file_search": {"vector_store_ids": [self._new_id("vs")]}
+                    },
+                }
+            )
+        if match := re.fullmatch(r".*/threads/([^/]+)/runs", path):
+            thread_id = match.group(1)
+            run_id = self._new_id("run")
+            if json.loads(body).get("stream"):
+                return self._stream_run(thread_id, run_id)
+            return self.send_json(self._run(thread_id, run_id))
+        if path.endswith("/chat/completions"):
+            return self._completion(json.loads(body))
+        self.not_found()
+
+    def route_delete(self, path, query, body):
+        object_id = path.rstrip("/").split("/")[-1]
+        self.send_json({"id": object_id, "deleted": True})
+
+    def _run(self, thread_id, run_id):
+        return {
+            "id": run_id,
+            "object": "thread.run",
+            "thread_id": thread_id,
+            "status": "completed",
+            "usage": {**self._usage(), "total_tokens": 0},
+        }
+
+    def _completion(self, request):
+        response_format = (request.get("response_format") or {}).get("json_schema", {})
+        if response_format.get("name") == "Assignments":
+            rows = json.loads(request["messages"][-1]["content"])
+            content = {
+                "assignments": [
+                    {"index": row["index"], "assigned_member": "All", "reason": "fake"}
+                    for row in rows
+                ]
+            }
+        else:
+            content = {
+                "rows": [
+                    {key.lower(): value for key, value in row.items()}
+                    for row in self.server.rows
+                ]
+            }
+
+        usage = self._usage()
+        self.send_json(
+            {
+                "id": self._new_id("chatcmpl"),
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {
+                            "role": "assistant",
+                            "content": json.dumps(content),
+                            "refusal": None,
+                        },
+                    }
+                ],
+                "usage": {**usage, "total_tokens": sum(usage.values())},
+            }
+        )
+
+    def _stream_run(self, thread_id, run_id):
+        """Server-sent events for a run whose message is one JSON row per line."""
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_event(event, data):
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+
+        run = self._run(thread_id, run_id)
+        message = {
+            "id": self._new_id("msg"),
+            "object": "thread.message",
+            "thread_id": thread_id,
+            "run_id": run_id,
+            "role": "assistant",
+            "status": "in_progress",
+            "content": [],
+        }
+        send_event("thread.run.created", {**run, "status": "queued"})
+        send_event("thread.message.created", message)
+        for row in self.server.rows:
+            if self.server.faults.latency:
+                time.sleep(self.server.faults.latency / 10)
+            delta = {
+                "id": message["id"],
+                "object": "thread.message.delta",
+                "delta": {
+                    "content": [
+                        {
+                            "index": 0,
+                            "type": "text",
+                            "text": {"value": json.dumps(row) + "\n"},
+                        }
+                    ]
+                },
+            }
+            send_event("thread.message.delta", delta)
+        text = "".join(json.dumps(row) + "\n" for row in self.server.rows)
+        completed = {
+            **message,
+            "status": "completed",
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+        }
+        send_event("thread.message.completed", completed)
+        send_event("thread.run.completed", run)
+        self.wfile.write(b"event: done\ndata: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def serve(handler_class, faults: Optional[Faults] = None, rows=None, port: int = 0):
+    """Start a fake server on a daemon thread. Returns the server; stop it with shutdown()."""
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler_class)
+    server.daemon_threads = True
+    server.faults = faults or Faults()
+    server.lock = threading.Lock()
+    server.rows = rows or []
+    server.state = {"ids": itertools.count(1), "expenses": {}, "assistants": []}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def splitwise_url(server) -> str:
+    return f"http://127.0.0.1:{server.server_port}/api/v3.0"
+
+
+def openai_url(server) -> str:
+    return f"http://127.0.0.1:{server.server_port}/v1"
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every request."
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="Fraction of requests that 500."
+    )
+    parser.add_argument(
+        "--rate-limit-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests that get a 429.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def faults_from_args(args) -> Faults:
+    return Faults(args.latency, args.error_rate, args.rate_limit_rate, seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_fault_arguments(parser)
+    parser.add_argument("--splitwise-port", type=int, default=8765)
+    parser.add_argument("--openai-port", type=int, default=8766)
+    parser.add_argument(
+        "--rows", type=int, default=50, help="Rows in every parsed statement."
+    )
+    args = parser.parse_args()
+
+    splitwise = serve(
+        Fake_splitwise_handler, faults_from_args(args), port=args.splitwise_port
+    )
+    fake_openai = serve(
+        Fake_openai_handler,
+        faults_from_args(args),
+        rows=fake_rows(args.rows, args.seed),
+        port=args.openai_port,
+    )
+    print(f"SPLITWISE_BASE_URL={splitwise_url(splitwise)}")
+    print(f"OPENAI_BASE_URL={openai_url(fake_openai)}")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
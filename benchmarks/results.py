@@ -0,0 +1,97 @@
+"""Recording benchmark results, and comparing them with the last recorded run.
+
+Each result is one JSON line in benchmarks/results.jsonl: the benchmark's name, its
+parameters, its measurements, and the git commit and time it was recorded at. A result
+is compared with the most recent earlier one that has the same name and parameters.
+"""
+
+import json
+import os
+import subprocess
+import time
+from typing import Optional
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+# A measurement this much worse than the last recorded one is flagged
+REGRESSION_THRESHOLD = 0.10
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(RESULTS_PATH),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_result(name: str, params: dict, path: str = RESULTS_PATH) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+
+    last = None
+    with open(path, "r") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            if result["name"] == name and result["params"] == params:
+                last = result
+    return last
+
+
+def compare(
+    name: str,
+    params: dict,
+    measurements: dict,
+    higher_is_better: set,
+    path: str = RESULTS_PATH,
+) -> list:
+    """Describe how each measurement moved since the last recorded run.
+
+    Measurements are lower-is-better unless named in higher_is_better.
+    """
+
+    previous = last_result(name, params, path)
+    if previous is None:
+        return []
+
+    lines = []
+    for key, value in measurements.items():
+        old = previous["measurements"].get(key)
+        if not old or not isinstance(value, (int, float)):
+            continue
+        change = (value - old) / old
+        worse = -change if key in higher_is_better else change
+        flag = "  REGRESSION" if worse > REGRESSION_THRESHOLD else ""
+        lines.append(
+            f"  {key}: {old:.4g} -> {value:.4g} ({change:+.1%} vs {previous['commit']}){flag}"
+        )
+    return lines
+
+
+def record(
+    name: str,
+    params: dict,
+    measurements: dict,
+    higher_is_better: set = frozenset(),
+    path: str = RESULTS_PATH,
+) -> list:
+    """Append a result, returning its comparison with the previous one (see compare)."""
+
+    comparison = compare(name, params, measurements, higher_is_better, path)
+    result = {
+        "name": name,
+        "params": params,
+        "measurements": measurements,
+        "commit": git_commit(),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(path, "a") as file:
+        file.write(json.dumps(result) + "\n")
+    return comparison
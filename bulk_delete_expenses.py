@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import re
+from typing import Iterator, Optional
+
+from splitwise_client import DEFAULT_MAX_WORKERS, Splitwise_client, load_secrets
+
+DEFAULT_JOURNAL = "delete_journal.jsonl"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Delete the Splitwise expenses in a group that match some filters"
+    )
+
+    parser.add_argument(
+        "--config", type=str, required=True, help="The path to the config JSON."
+    )
+    parser.add_argument(
+        "--dated-after", type=str, help="Only expenses dated after this (YYYY-MM-DD)."
+    )
+    parser.add_argument(
+        "--dated-before", type=str, help="Only expenses dated before this (YYYY-MM-DD)."
+    )
+    parser.add_argument(
+        "--description",
+        type=str,
+        help="Only expenses whose description matches this regex (case-insensitive).",
+    )
+    parser.add_argument(
+        "--created-by", type=int, help="Only expenses created by this user ID."
+    )
+
+    # Optional boolean flag (by default False, True if present)
+    parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="Actually deletes the expenses if specified; otherwise only lists them",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Number of expenses to delete concurrently.",
+    )
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=DEFAULT_JOURNAL,
+        help="Where to record deleted expenses. Expenses already in the journal are "
+        "skipped, so an interrupted cleanup can be resumed by re-running it.",
+    )
+
+    return parser.parse_args()
+
+
+def select_expenses(
+    splitwise_client: Splitwise_client,
+    group_id,
+    dated_after: Optional[str] = None,
+    dated_before: Optional[str] = None,
+    description: Optional[str] = None,
+    created_by: Optional[int] = None,
+) -> Iterator[dict]:
+    """Yield the group's (non-deleted) expenses that match every given filter."""
+
+    description_re = re.compile(description, re.IGNORECASE) if description else None
+
+    for expense in splitwise_client.iter_expenses(
+        group_id, dated_after=dated_after, dated_before=dated_before
+    ):
+        if expense.get("deleted_at"):
+            continue
+        if description_re and not description_re.search(expense["description"]):
+            continue
+        creator = (expense.get("created_by") or {}).get("id")
+        if created_by is not None and creator != created_by:
+            continue
+        yield expense
+
+
+def load_journal(journal_path: str) -> set:
+    """The IDs of expenses a previous run already deleted."""
+
+    if not os.path.exists(journal_path):
+        return set()
+
+    with open(journal_path, "r") as journal:
+        return {json.loads(line)["expense_id"] for line in journal if line.strip()}
+
+
+def delete_expenses(
+    splitwise_client: Splitwise_client,
+    expenses: list,
+    journal_path: str = DEFAULT_JOURNAL,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> list:
+    """Delete expenses concurrently, journaling each one as soon as it's deleted."""
+
+    already_deleted = load_journal(journal_path)
+    expense_ids = [
+        expense["id"] for expense in expenses if expense["id"] not in already_deleted
+    ]
+
+    results = []
+    with open(journal_path, "a") as journal:
+        for result in splitwise_client.delete_expenses(expense_ids, max_workers):
+            results.append(result)
+            if result.success:
+                journal.write(json.dumps({"expense_id": result.expense_id}) + "\n")
+                journal.flush()
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    with open(args.config, "r") as config_file:
+        config = json.load(config_file)
+
+    group_id = config.get("group_id", None)
+    if group_id is None:
+        raise ValueError("No group_id found in the configuration file!")
+
+    splitwise_client = Splitwise_client(load_secrets())
+    expenses = list(
+        select_expenses(
+            splitwise_client,
+            group_id,
+            dated_after=args.dated_after,
+            dated_before=args.dated_before,
+            description=args.description,
+            created_by=args.created_by,
+        )
+    )
+
+    for expense in expenses:
+        print(
+            f"{expense['id']}: {expense['date'][:10]} {expense['description']} ({expense['cost']})"
+        )
+    print(f"{len(expenses)} expenses match.")
+
+    if not args.delete:
+        print("NOT deleting. Add --delete to delete them.")
+        raise SystemExit(0)
+
+    results = delete_expenses(
+        splitwise_client, expenses, args.journal, max_workers=args.max_workers
+    )
+    failures = [result for result in results if not result.success]
+    print(f"Deleted {len(results) - len(failures)}/{len(results)} expenses.")
+    for result in failures:
+        print(f"FAILED: {result.expense_id}: {result.error}")
+
+    if failures:
+        raise SystemExit(1)
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Tuple
+
+
+def format_cents(cents: int) -> str:
+    """Format integer cents as a decimal string, e.g. 1234 -> "12.34"."""
+
+    sign = "-" if cents < 0 else ""
+    dollars, cents = divmod(abs(cents), 100)
+    return f"{sign}{dollars}.{cents:02d}"
+
+
+def parse_cents(amount: str) -> int:
+    """Parse a decimal string such as "12.3" into integer cents, exactly."""
+
+    return int((Decimal(amount) * 100).to_integral_value())
+
+
+@dataclass(slots=True)
+class Expense:
+    """A Splitwise expense. Amounts are integer cents; shares are parallel tuples indexed by user."""
+
+    cost_cents: int
+    description: str
+    date: str  # YYYY-MM-DD
+    group_id: str
+    user_ids: Tuple[int, ...]
+    paid_cents: Tuple[int, ...]
+    owed_cents: Tuple[int, ...]
+    details: str
+
+    @property
+    def cost(self) -> str:
+        return format_cents(self.cost_cents)
+
+    def to_form_data(self) -> dict:
+        """The create_expense payload, with shares in the users__N__* form."""
+
+        data = {
+            "cost": format_cents(self.cost_cents),
+            "description": self.description,
+            "details": self.details,
+            "date": self.date,
+            "group_id": self.group_id,
+        }
+        for index, (user_id, paid, owed) in enumerate(
+            zip(self.user_ids, self.paid_cents, self.owed_cents)
+        ):
+            data[f"users__{index}__user_id"] = user_id
+            data[f"users__{index}__paid_share"] = format_cents(paid)
+            data[f"users__{index}__owed_share"] = format_cents(owed)
+        return data
+
+    def key(self) -> tuple:
+        """Identifies the expense for de-duplication: (date, cost, description, shares)."""
+
+        shares = tuple(
+            sorted(
+                (user_id, paid, owed)
+                for user_id, paid, owed in zip(
+                    self.user_ids, self.paid_cents, self.owed_cents
+                )
+                if paid or owed
+            )
+        )
+        return (self.date, self.cost_cents, self.description.strip(), shares)
+
+
+def key_from_api(expense: dict) -> tuple:
+    """The Expense.key() of an expense as returned by Splitwise's get_expenses."""
+
+    shares = tuple(
+        sorted(
+            (
+                user["user_id"],
+                parse_cents(user["paid_share"]),
+                parse_cents(user["owed_share"]),
+            )
+            for user in expense["users"]
+            if parse_cents(user["paid_share"]) or parse_cents(user["owed_share"])
+        )
+    )
+    return (
+        expense["date"][:10],
+        parse_cents(expense["cost"]),
+        expense["description"].strip(),
+        shares,
+    )
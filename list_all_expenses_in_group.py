@@ -1,16 +1,27 @@
 import argparse
 import json
+import sys
 
-from splitwise_client import Splitwise_client
+from splitwise_client import Splitwise_client, load_secrets
 
 
 def parse_args():
     parser = argparse.ArgumentParser(
-        description="Parse a bayclub statement and upload charges to splitwise"
+        description="Print a Splitwise group's expenses, one JSON object per line"
     )
 
-    # Two positional arguments for file paths
     parser.add_argument("--config", type=str, help="The path to the config JSON.")
+    parser.add_argument(
+        "--dated-after", type=str, help="Only expenses dated after this (YYYY-MM-DD)."
+    )
+    parser.add_argument(
+        "--dated-before", type=str, help="Only expenses dated before this (YYYY-MM-DD)."
+    )
+    parser.add_argument(
+        "--updated-after",
+        type=str,
+        help="Only expenses updated after this (YYYY-MM-DD).",
+    )
     return parser.parse_args()
 
 
@@ -19,10 +30,13 @@ if __name__ == "__main__":
     with open(args.config, "r") as config_file:
         config = json.load(config_file)
 
-    with open("secrets.json", "r") as file:
-        secrets = json.load(file)
-
     group_id = config.get("group_id", None)
 
-    splitwise_client = Splitwise_client(secrets)
-    splitwise_client.get_all_expenses(group_id)
+    splitwise_client = Splitwise_client(load_secrets())
+    for expense in splitwise_client.iter_expenses(
+        group_id,
+        dated_after=args.dated_after,
+        dated_before=args.dated_before,
+        updated_after=args.updated_after,
+    ):
+        sys.stdout.write(json.dumps(expense, separators=(",", ":")) + "\n")
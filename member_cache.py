@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from assignment_rules import UNKNOWN_MEMBER_KEY, normalize_name
+from splitwise_client import Splitwise_client
+
+DEFAULT_MEMBER_CACHE_PATH = ".member_cache.json"
+DEFAULT_TTL_SECONDS = 60 * 60
+
+
+class Member_cache:
+    """Caches each group's name -> user ID mapping for ttl_seconds.
+
+    Always kept in memory; also persisted to cache_path (if given) so separate runs share it.
+    """
+
+    def __init__(
+        self,
+        splitwise_client: Splitwise_client,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        cache_path: Optional[str] = DEFAULT_MEMBER_CACHE_PATH,
+    ):
+        self.splitwise_client = splitwise_client
+        self.ttl_seconds = ttl_seconds
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        # str(group_id) -> {"fetched_at": ..., "name_to_id": {...}}
+        self.entries = self._load()
+
+    def _load(self) -> dict:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.entries, file, indent=4)
+        os.replace(tmp_path, self.cache_path)
+
+    def get(self, group_id) -> Dict[str, int]:
+        """The group's members as {full name: user ID}, fetched at most once per TTL."""
+
+        key = str(group_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry["fetched_at"] < self.ttl_seconds:
+                return dict(entry["name_to_id"])
+
+            name_to_id = self.splitwise_client.get_group_members(group_id)
+            # Splitwise's placeholder member has no last name
+            if "Unknown None" in name_to_id:
+                name_to_id[UNKNOWN_MEMBER_KEY] = name_to_id.pop("Unknown None")
+
+            # Don't cache a failed lookup
+            if name_to_id:
+                self.entries[key] = {
+                    "fetched_at": time.time(),
+                    "name_to_id": name_to_id,
+                }
+                self._save()
+            return dict(name_to_id)
+
+    def invalidate(self, group_id=None):
+        """Forget one group's members, or every group's if no group_id is given."""
+
+        with self.lock:
+            if group_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(str(group_id), None)
+            self._save()
+
+
+class Name_index:
+    """Resolves member names to user IDs, tolerating case, spacing, first names and aliases.
+
+    Lookups are tried in order: exact name, case/whitespace-insensitive full name, alias
+    (from the config's "aliases", mapping an alias to a member's full name), and first name
+    when no other member shares it.
+    """
+
+    def __init__(self, name_to_id: Dict[str, int], aliases: Optional[dict] = None):
+        self.name_to_id = dict(name_to_id)
+        self.index = {}
+
+        full_names = {
+            normalize_name(name): user_id for name, user_id in name_to_id.items()
+        }
+
+        first_names = {}
+        for name, user_id in full_names.items():
+            first_names.setdefault(name.split(" ")[0], set()).add(user_id)
+
+        # Lowest priority first, so higher priority entries overwrite them
+        for first_name, user_ids in first_names.items():
+            if len(user_ids) == 1:
+                self.index[first_name] = next(iter(user_ids))
+        for alias, name in (aliases or {}).items():
+            if normalize_name(name) not in full_names:
+                raise ValueError(f"Alias '{alias}' refers to unknown member '{name}'")
+            self.index[normalize_name(alias)] = full_names[normalize_name(name)]
+        self.index.update(full_names)
+
+    def resolve(self, name) -> Optional[int]:
+        """The user ID for a name, or None if it doesn't match any member."""
+
+        if not isinstance(name, str):
+            return None
+        if name in self.name_to_id:
+            return self.name_to_id[name]
+        return self.index.get(normalize_name(name))
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def to_cents(amounts) -> np.ndarray:
+    """Convert dollar amounts (floats with at most 2 decimals) to integer cents."""
+
+    return np.rint(np.asarray(amounts, dtype=float) * 100).astype(np.int64)
+
+
+def split_cents(totals, weights) -> np.ndarray:
+    """Split each total into shares proportional to weights, using the largest-remainder method.
+
+    totals: integer cents, one per row. weights: positive integers, one per share.
+    Returns an int64 array of shape (len(totals), len(weights)) whose rows sum exactly to
+    their totals. Each share gets the floor of its exact quota, and the leftover cents go
+    to the shares with the largest remainders, ties going to the earlier share.
+    """
+
+    totals = np.asarray(totals, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.int64)
+    total_weight = weights.sum()
+
+    numerators = totals[:, None] * weights[None, :]
+    shares, remainders = np.divmod(numerators, total_weight)
+    leftover = totals - shares.sum(axis=1)
+
+    # Rank each share by remainder (largest first, stable so ties keep member order)
+    order = np.argsort(-remainders, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(len(weights))[None, :], axis=1)
+
+    return shares + (ranks < leftover[:, None])
+
+
+def split_evenly(totals, num_shares: int) -> np.ndarray:
+    """Split each total into num_shares shares that differ by at most a cent."""
+
+    return split_cents(totals, np.ones(num_shares, dtype=np.int64))
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import threading
+import time
+from typing import List, Optional
+
+import pandas as pd
+
+from parse_config import DEFAULT_PARSE_MODE, MODEL, build_instructions
+
+DEFAULT_CACHE_DIR = ".parse_cache"
+DEFAULT_MAX_ENTRIES = 100
+DEFAULT_MAX_AGE_DAYS = 90
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of a file's contents."""
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Parse_cache:
+    """On-disk cache of parsed statements, keyed by the PDF's contents, the members and the prompt/model.
+
+    Entries are evicted once they're older than `max_age_days`, and the least recently used
+    entries are dropped once there are more than `max_entries` of them.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_age_days: float = DEFAULT_MAX_AGE_DAYS,
+    ):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+
+    def key(
+        self,
+        file_path: str,
+        members: List[str],
+        parse_mode: str = DEFAULT_PARSE_MODE,
+    ) -> str:
+        digest = hashlib.sha256()
+        digest.update(hash_file(file_path).encode())
+        digest.update(MODEL.encode())
+        digest.update(build_instructions(members, parse_mode).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        path = self._path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except FileNotFoundError:
+            return None
+
+        if age > self.max_age_seconds:
+            return None
+
+        try:
+            # Mark as recently used
+            os.utime(path)
+            with open(path, "r") as file:
+                return pd.read_json(
+                    file, orient="records", dtype=False, convert_dates=False
+                )
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, statement: pd.DataFrame):
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Write to a temporary file first so a crash never leaves a truncated entry
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        statement.to_json(tmp_path, orient="records")
+        os.replace(tmp_path, path)
+
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones beyond max_entries."""
+
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                mtime = os.path.getmtime(path)
+                if now - mtime > self.max_age_seconds:
+                    os.remove(path)
+                else:
+                    entries.append((mtime, path))
+            except FileNotFoundError:
+                # Another run sharing the cache evicted it first
+                continue
+
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries :]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
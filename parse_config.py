@@ -0,0 +1,61 @@
+"""How statements get parsed: the model, the parse modes and the prompts.
+
+Kept free of heavy imports (openai, pandas) so the CLI can read these settings, and the
+parse cache can key on them, without loading the parser.
+"""
+
+from typing import List
+
+MODEL = "gpt-4o"
+
+# How a statement PDF gets parsed: "structured" attaches the PDF to a chat completion whose
+# response is constrained to the Parsed_statement schema; "assistant" has the assistant
+# write a JSON file with code_interpreter, which is then downloaded.
+STRUCTURED_PARSE_MODE = "structured"
+ASSISTANT_PARSE_MODE = "assistant"
+PARSE_MODES = [STRUCTURED_PARSE_MODE, ASSISTANT_PARSE_MODE]
+DEFAULT_PARSE_MODE = STRUCTURED_PARSE_MODE
+# How --local-extract rows are labelled in the statement store. Not a --parse-mode choice.
+LOCAL_PARSE_MODE = "local"
+
+DEFAULT_PAGES_PER_CHUNK = 1
+DEFAULT_PARALLEL_CHUNKS = 4
+
+
+def build_assignment_rules(members: List[str]) -> str:
+    return f"""Here are the rules for deriving the responsible person from the row description:
+    
+    1. Dues are always “All” regardless of what name is associated with the row in the PDF.
+    2. Only parse the user name if it's not surrounded by parens. e.g. "No Show Fee (Amy Buffet) No Show Fee John Doe" should be assigned to John Doe, not Amy Buffet
+    3. ASSIGN TO THE FIRST NAME IF MULTIPLE NAMES SHOW UP regardless of case, e.g. "Court Fee 8/10 {members[0]} court time {members[1]} primary" should be assigned to "{members[0]}" instead of "{members[1]}"
+    4. If it sounds like a shared responsibility, e.g. "shared membership ..." assign it to "All"
+    5. Assign to "Unknown" if you can't figure it out.
+    6.  The first 3 are hard rules. 4 and 5 are soft and require some judgment.
+    """
+
+
+def build_instructions(
+    members: List[str], parse_mode: str = ASSISTANT_PARSE_MODE
+) -> str:
+    """The parsing instructions for a parse mode. Any change here invalidates cached parses."""
+
+    if parse_mode == ASSISTANT_PARSE_MODE:
+        output_instruction = "Offer the result as a file to download, no need to print out the JSON as part of the conversation"
+    else:
+        output_instruction = "Return every row of the statement, in order"
+
+    instructions = f"""You are a helpful assistant who is proficient at parsing PDFs and processing data.
+
+    You will be given PDFs that represent billing statements for a group, and you are tasked with
+    processing it into a table (in JSON format).
+
+    1. Use quotes to escape commas
+    2. Derive a "Responsible person" column that is either one of the members, or “All” or “Unknown”. The members are "{members}". 
+    3. Use the following keys for each row in the JSON output: “Date,Amount,Description,Assigned_member,Reason”, where reason is your rationale for how you derived the responsible person (see more about rules below).
+    4. Include the full description (e.g. merge multiple lines into one if necessary) for human consumption
+    5. {output_instruction}
+
+    {build_assignment_rules(members)}
+    Remember to think step by step, and double check your work.
+    """
+    return instructions
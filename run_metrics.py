@@ -0,0 +1,190 @@
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# USD per million (prompt, completion) tokens, for cost estimates only
+PRICES_PER_MILLION_TOKENS = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+# Splitwise paths with IDs in them, e.g. delete_expense/123, are counted as one endpoint
+ID_RE = re.compile(r"/\d+")
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an unsorted list."""
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimated USD cost of a call, or 0 for models without a known price."""
+
+    prompt_price, completion_price = PRICES_PER_MILLION_TOKENS.get(model, (0, 0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+class Run_metrics:
+    """Timings, HTTP calls and token usage for one run. Thread-safe.
+
+    Stages are timed with `with metrics.stage("name"):`; a stage entered several times
+    (e.g. once per chunk) accumulates its count and total time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        # name -> {"count": ..., "seconds": ...}
+        self.stages = {}
+        # (method, endpoint) -> {"statuses": {status: count}, "latencies": [seconds, ...]}
+        self.http_calls = {}
+        # model -> {"calls": ..., "prompt_tokens": ..., "completion_tokens": ...}
+        self.usage = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - started_at)
+
+    def record_stage(self, name: str, seconds: float):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"count": 0, "seconds": 0.0})
+            stage["count"] += 1
+            stage["seconds"] += seconds
+
+    def record_http(self, method: str, path: str, status, seconds: float):
+        """Record one HTTP attempt. status is the status code, or an exception name."""
+
+        endpoint = ID_RE.sub("/{id}", "/" + path.strip("/"))
+        with self.lock:
+            call = self.http_calls.setdefault(
+                (method.upper(), endpoint), {"statuses": {}, "latencies": []}
+            )
+            call["statuses"][str(status)] = call["statuses"].get(str(status), 0) + 1
+            call["latencies"].append(seconds)
+
+    def record_usage(self, model: str, usage):
+        """Record the token usage of an OpenAI response (its `usage`, which may be None)."""
+
+        if usage is None:
+            return
+        with self.lock:
+            totals = self.usage.setdefault(
+                model, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+            )
+            totals["calls"] += 1
+            totals["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            totals["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+
+    def report(self) -> dict:
+        with self.lock:
+            http = [
+                {
+                    "method": method,
+                    "endpoint": endpoint,
+                    "count": len(call["latencies"]),
+                    "statuses": dict(call["statuses"]),
+                    "seconds_total": sum(call["latencies"]),
+                    "seconds_p50": percentile(call["latencies"], 0.5),
+                    "seconds_p95": percentile(call["latencies"], 0.95),
+                    "seconds_max": max(call["latencies"]),
+                }
+                for (method, endpoint), call in sorted(self.http_calls.items())
+            ]
+            openai_usage = {
+                model: {
+                    **totals,
+                    "estimated_cost_usd": estimate_cost(
+                        model, totals["prompt_tokens"], totals["completion_tokens"]
+                    ),
+                }
+                for model, totals in self.usage.items()
+            }
+
+            return {
+                "started_at": self.started_at,
+                "seconds": time.time() - self.started_at,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "http": http,
+                "openai": openai_usage,
+                "estimated_cost_usd": sum(
+                    usage["estimated_cost_usd"] for usage in openai_usage.values()
+                ),
+            }
+
+    def write_json(self, path: str):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=4)
+
+    def to_prometheus(self, prefix: str = "bayclub") -> str:
+        """The report in the Prometheus text exposition format."""
+
+        report = self.report()
+        families = {
+            ("run_seconds", "gauge"): [("", report["seconds"])],
+            ("stage_seconds_total", "counter"): [
+                (f'stage="{name}"', stage["seconds"])
+                for name, stage in report["stages"].items()
+            ],
+            ("stage_count", "counter"): [
+                (f'stage="{name}"', stage["count"])
+                for name, stage in report["stages"].items()
+            ],
+            ("http_requests_total", "counter"): [
+                (
+                    f'method="{call["method"]}",endpoint="{call["endpoint"]}",status="{status}"',
+                    count,
+                )
+                for call in report["http"]
+                for status, count in call["statuses"].items()
+            ],
+            ("http_request_seconds_total", "counter"): [
+                (
+                    f'method="{call["method"]}",endpoint="{call["endpoint"]}"',
+                    call["seconds_total"],
+                )
+                for call in report["http"]
+            ],
+            ("openai_tokens_total", "counter"): [
+                (f'model="{model}",kind="{kind}"', usage[f"{kind}_tokens"])
+                for model, usage in report["openai"].items()
+                for kind in ("prompt", "completion")
+            ],
+            ("openai_estimated_cost_usd", "counter"): [
+                (f'model="{model}"', usage["estimated_cost_usd"])
+                for model, usage in report["openai"].items()
+            ],
+        }
+
+        lines = []
+        for (name, metric_type), samples in families.items():
+            lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+            for labels, value in samples:
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{prefix}_{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        with open(path, "w") as file:
+            file.write(self.to_prometheus())
+
+
+def write_metrics(
+    metrics: Run_metrics,
+    json_path: Optional[str] = None,
+    prometheus_path: Optional[str] = None,
+):
+    """Write whichever of the JSON report and Prometheus text were asked for."""
+
+    if json_path:
+        metrics.write_json(json_path)
+    if prometheus_path:
+        metrics.write_prometheus(prometheus_path)
@@ -1,10 +1,132 @@
 import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Optional
 
+import requests
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth1Session
+from urllib3.exceptions import NewConnectionError
+
+from expense import Expense
+from rate_limiter import Token_bucket
+from run_metrics import Run_metrics
+
+# Overridable so the scripts can be pointed at a local fake (see benchmarks/fake_servers.py)
+BASE_URL = os.environ.get("SPLITWISE_BASE_URL", "https://secure.splitwise.com/api/v3.0")
+
+# Number of concurrent create_expense calls when uploading in bulk
+DEFAULT_MAX_WORKERS = 8
+# Expenses that can wait for an upload worker before whatever produces them is held back
+DEFAULT_QUEUE_SIZE = 32
+
+# Expenses fetched per get_expenses call when listing a group
+DEFAULT_PAGE_SIZE = 100
+
+# Connections kept alive per client. Batch runs upload several statements at once, each
+# with DEFAULT_MAX_WORKERS uploads in flight.
+DEFAULT_POOL_SIZE = 32
+
+# Client-side throttle shared by every request made through one client
+DEFAULT_REQUESTS_PER_SECOND = 10
+DEFAULT_BURST = 10
+
+# (connect, read) seconds, so a hung connection can't hold an upload worker forever
+DEFAULT_TIMEOUT = (5, 30)
+
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+@dataclass
+class Upload_result:
+    """Outcome of uploading a single expense."""
+
+    expense: Expense
+    success: bool
+    expense_id: Optional[int] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class Delete_result:
+    """Outcome of deleting a single expense."""
+
+    expense_id: int
+    success: bool
+    error: Optional[str] = None
+
+
+class UploadInterruptedError(Exception):
+    """The expenses to upload stopped coming partway through, e.g. because a GPT stream failed.
+
+    results has the Upload_result of every expense submitted before that; the original
+    error is the __cause__.
+    """
+
+    def __init__(self, results):
+        super().__init__(f"Stopped after submitting {len(results)} expenses")
+        self.results = results
+
+
+def load_secrets(file_path="secrets.json"):
+    with open(file_path, "r") as file:
+        return json.load(file)
+
+
+def retry_after_seconds(response) -> Optional[float]:
+    """Parse a Retry-After header (either seconds or an HTTP date)."""
+
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def never_connected(error: requests.exceptions.RequestException) -> bool:
+    """Whether a request failed before its connection was open, so the server never saw it."""
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        # requests wraps urllib3's MaxRetryError, whose reason is the underlying failure
+        reason = getattr(error.args[0], "reason", error.args[0])
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def backoff_seconds(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+
+    cap = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+    return random.uniform(0, cap)
 
 
 class Splitwise_client:
-    def __init__(self, secrets):
+    def __init__(
+        self,
+        secrets,
+        base_url=BASE_URL,
+        requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+        max_retries=DEFAULT_MAX_RETRIES,
+        metrics: Optional[Run_metrics] = None,
+        timeout=DEFAULT_TIMEOUT,
+    ):
         consumer_key = secrets["consumer_key"]
         consumer_secret = secrets["consumer_secret"]
         access_token = secrets["access_token"]
@@ -16,106 +138,291 @@ class Splitwise_client:
             resource_owner_key=access_token,
             resource_owner_secret=access_token_secret,
         )
+        # One keep-alive connection pool, big enough for concurrent uploads and deletes
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=DEFAULT_POOL_SIZE)
+        self.oauth.mount("https://", adapter)
+        self.oauth.mount("http://", adapter)
 
-    def get_all_expenses(self, group_id):
-        """Fetch all expenses in a group."""
+        self.base_url = base_url.rstrip("/")
+        self.rate_limiter = Token_bucket(requests_per_second, DEFAULT_BURST)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.metrics = metrics or Run_metrics()
 
-        # Set the endpoint URL to get group details
-        url = f"https://secure.splitwise.com/api/v3.0/get_expenses?group_id={group_id}"
-        # Send the request to Splitwise to get group details
+    def _send(self, method, path, url, **kwargs):
+        """One attempt at a request, recorded in the client's metrics."""
+
+        started_at = time.perf_counter()
+        try:
+            response = self.oauth.request(
+                method, url, **{"timeout": self.timeout, **kwargs}
+            )
+        except requests.exceptions.RequestException as e:
+            self.metrics.record_http(
+                method, path, type(e).__name__, time.perf_counter() - started_at
+            )
+            raise
+        self.metrics.record_http(
+            method, path, response.status_code, time.perf_counter() - started_at
+        )
+        return response
+
+    def _request(self, method, path, idempotent=True, **kwargs):
+        """Send a request through the rate limiter, retrying 429s and transient failures.
+
+        Non-idempotent requests (e.g. create_expense) are only retried when the server
+        can't have acted on them: a 429, or a connection that was never established (a
+        connect timeout or a refused connection).
+        """
+
+        url = f"{self.base_url}/{path.lstrip('/')}"
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            is_last_attempt = attempt == self.max_retries
+
+            try:
+                response = self._send(method, path, url, **kwargs)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                if is_last_attempt or not (idempotent or never_connected(e)):
+                    raise
+                delay = backoff_seconds(attempt)
+                logging.warning(f"{method} {path} failed, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
 
-        response = self.oauth.get(url)
+            retryable = response.status_code == 429 or (
+                idempotent and response.status_code in RETRYABLE_STATUS_CODES
+            )
+            if not retryable or is_last_attempt:
+                return response
+
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = backoff_seconds(attempt)
+            if response.status_code == 429:
+                # Everyone sharing this client should back off, not just this call
+                self.rate_limiter.pause(delay)
+            logging.warning(
+                f"{method} {path} got {response.status_code}, retrying in {delay:.1f}s"
+            )
+            time.sleep(delay)
+
+    def iter_expenses(
+        self,
+        group_id,
+        dated_after=None,
+        dated_before=None,
+        updated_after=None,
+        page_size=DEFAULT_PAGE_SIZE,
+    ):
+        """Yield a group's expenses one page at a time, optionally filtered by date.
+
+        Dates are YYYY-MM-DD (or full ISO 8601) strings. Only one page is held in memory.
+        """
+
+        params = {"group_id": group_id, "limit": page_size}
+        if dated_after is not None:
+            params["dated_after"] = dated_after
+        if dated_before is not None:
+            params["dated_before"] = dated_before
+        if updated_after is not None:
+            params["updated_after"] = updated_after
+
+        offset = 0
+        while True:
+            response = self._request(
+                "GET", "get_expenses", params={**params, "offset": offset}
+            )
+
+            if response.status_code != 200:
+                print(f"Failed to get group expenses: {response.status_code}")
+                print(response.text)
+                raise RuntimeError(
+                    f"Failed to get group expenses: {response.status_code}"
+                )
+
+            expenses = response.json()["expenses"]
+            yield from expenses
+
+            if len(expenses) < page_size:
+                return
+            offset += page_size
+
+    def get_all_expenses(
+        self, group_id, dated_after=None, dated_before=None, updated_after=None
+    ):
+        """Fetch all expenses in a group, optionally only those within a date window."""
+
+        try:
+            expenses = list(
+                self.iter_expenses(group_id, dated_after, dated_before, updated_after)
+            )
+        except RuntimeError:
+            return {}
+        return {"expenses": expenses}
+
+    def get_current_user(self):
+        """Fetch the user whose access token we're using."""
+
+        response = self._request("GET", "get_current_user")
 
         if response.status_code == 200:
-            expenses = response.json()
-            print(json.dumps(expenses, indent=4))
-            return expenses
+            return response.json()["user"]
         else:
-            print(f"Failed to get group expenses: {response.status_code}")
+            print(f"Failed to get current user: {response.status_code}")
             print(response.text)
             return {}
 
-    def get_group_members(self, group_id):
-        """Fetch the members of a group and return a dictionary mapping full names to user IDs."""
+    def get_friends(self):
+        """Fetch the current user's friends."""
+
+        response = self._request("GET", "get_friends")
+
+        if response.status_code == 200:
+            return response.json()["friends"]
+        else:
+            print(f"Failed to get friends: {response.status_code}")
+            print(response.text)
+            return []
+
+    def get_group(self, group_id):
+        """Fetch a group's details, including its members."""
 
-        # Set the endpoint URL to get group details
-        url = f"https://secure.splitwise.com/api/v3.0/get_group/{group_id}"
         # Send the request to Splitwise to get group details
-        response = self.oauth.get(url)
+        response = self._request("GET", f"get_group/{group_id}")
 
         if response.status_code == 200:
-            group_info = response.json()
-            members = group_info["group"]["members"]
-
-            # Create a dictionary mapping full name to user ID
-            name_to_id = {}
-            for member in members:
-                first_name = member["first_name"]
-                last_name = member.get("last_name", "")
-                full_name = f"{first_name} {last_name}".strip()
-                name_to_id[full_name] = member["id"]
-
-            return name_to_id
+            return response.json()["group"]
         else:
             print(f"Failed to get group details: {response.status_code}")
             print(response.text)
             return {}
 
-    def add_expense(self, expense):
-        """Create a new expense on Splitwise using user IDs."""
+    def get_group_members(self, group_id):
+        """Fetch the members of a group and return a dictionary mapping full names to user IDs."""
 
-        (cost, description, date, group_id, user_shares, details) = expense
+        group = self.get_group(group_id)
 
-        # Set the endpoint URL to create an expense
-        url = "https://secure.splitwise.com/api/v3.0/create_expense"
+        # Create a dictionary mapping full name to user ID
+        name_to_id = {}
+        for member in group.get("members", []):
+            first_name = member["first_name"]
+            last_name = member.get("last_name", "")
+            full_name = f"{first_name} {last_name}".strip()
+            name_to_id[full_name] = member["id"]
 
-        # Prepare the expense data, including date
-        data = {
-            "cost": str(cost),
-            "description": description,
-            "details": details,
-            "date": date,  # Add the date here in the format YYYY-MM-DD
-            "group_id": group_id,  # Must be provided
-        }
+        return name_to_id
 
-        # Add users and their shares in the indexed format (users__0__user_id, etc.)
-        for index, (user_id, shares) in enumerate(user_shares.items()):
-            data[f"users__{index}__user_id"] = user_id  # Use user_id instead of names
-            data[f"users__{index}__paid_share"] = f"{shares['paid']:.2f}"
-            data[f"users__{index}__owed_share"] = f"{shares['owed']:.2f}"
+    def add_expense(self, expense):
+        """Create a new Expense on Splitwise. Returns an Upload_result."""
+
+        data = expense.to_form_data()
 
         # Send the request to Splitwise to create the expense
-        response = self.oauth.post(url, data=data)
+        try:
+            response = self._request(
+                "POST", "create_expense", idempotent=False, data=data
+            )
+        except Exception as e:
+            print(f"Failed to create expense: {e}")
+            return Upload_result(expense, success=False, error=str(e))
 
         if response.status_code == 200:
             response = response.json()
             errors = response["errors"]
             if not errors:
                 print("Expense created successfully!")
+                created = response.get("expenses") or [{}]
+                return Upload_result(
+                    expense, success=True, expense_id=created[0].get("id")
+                )
             else:
                 print("Got an error", "Tried to submit data", data)
                 print("The error was", errors)
+                return Upload_result(expense, success=False, error=str(errors))
         else:
             print(f"Failed to create expense: {response.status_code}")
             print(response.text)
+            return Upload_result(
+                expense, success=False, error=f"{response.status_code}: {response.text}"
+            )
 
-    def delete_expense(self, expense_id):
-        """Delete an expense."""
+    def add_expenses(self, expenses, max_workers=DEFAULT_MAX_WORKERS):
+        """Create many expenses concurrently. Returns one Upload_result per expense, in order.
 
-        # Set the endpoint URL to create an expense
-        url = f"https://secure.splitwise.com/api/v3.0/delete_expense/{expense_id}"
+        expenses can be a generator; each expense is uploaded as soon as it's yielded. If
+        the generator raises, the uploads already started are waited for and summarized,
+        and an UploadInterruptedError with their results is raised.
+        """
 
-        # Send the request to Splitwise to create the expense
-        response = self.oauth.post(url, data={})
+        futures = []
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            try:
+                for expense in expenses:
+                    futures.append(executor.submit(self.add_expense, expense))
+            except Exception as e:
+                # add_expense never raises, so every started upload has a result
+                results = [future.result() for future in futures]
+                print_upload_summary(results)
+                raise UploadInterruptedError(results) from e
+            results = [future.result() for future in futures]
+
+        print_upload_summary(results)
+        return results
+
+    def delete_expense(self, expense_id):
+        """Delete an expense. Returns a Delete_result."""
+
+        # Send the request to Splitwise to delete the expense. Deleting twice is harmless,
+        # so this is safe to retry.
+        try:
+            response = self._request("POST", f"delete_expense/{expense_id}", data={})
+        except Exception as e:
+            print(f"Failed to delete expense: {e}")
+            return Delete_result(expense_id, success=False, error=str(e))
 
         if response.status_code == 200:
             response = response.json()
             errors = response["errors"]
             if not errors:
                 print("Expense deleted successfully!")
+                return Delete_result(expense_id, success=True)
             else:
                 print("Got an error")
                 print("The error was", errors)
+                return Delete_result(expense_id, success=False, error=str(errors))
         else:
             print(f"Failed to delete expense: {response.status_code}")
             print(response.text)
+            return Delete_result(
+                expense_id,
+                success=False,
+                error=f"{response.status_code}: {response.text}",
+            )
+
+    def delete_expenses(self, expense_ids, max_workers=DEFAULT_MAX_WORKERS):
+        """Delete many expenses concurrently, yielding a Delete_result as each one finishes."""
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [
+                executor.submit(self.delete_expense, expense_id)
+                for expense_id in expense_ids
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+
+
+def print_upload_summary(results):
+    """Print how many uploads succeeded and list the ones that failed."""
+
+    failures = [result for result in results if not result.success]
+    print(f"Uploaded {len(results) - len(failures)}/{len(results)} expenses.")
+    for result in failures:
+        expense = result.expense
+        print(
+            f"FAILED: {expense.date} {expense.description} ({expense.cost}): {result.error}"
+        )
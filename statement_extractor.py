@@ -0,0 +1,158 @@
+import logging
+import os
+import re
+from typing import Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+# A statement row starts with its date, e.g. "10/01/2024", "10/01/24" or "10/01"
+ROW_START_RE = re.compile(r"^\s*(\d{1,2}/\d{1,2}(?:/\d{2,4})?)\s+(.*)$")
+# A date with a year anywhere on a line, e.g. in "Statement period 09/01/2024 - 09/30/2024"
+FULL_DATE_RE = re.compile(r"\b(\d{1,2})/\d{1,2}/(\d{4}|\d{2})\b")
+# Amounts look like "1,234.56", "$1,234.56", "-12.00" or "(12.00)"
+AMOUNT_RE = re.compile(r"\(?-?\$?\d{1,3}(?:,\d{3})*\.\d{2}\)?")
+# Page furniture and summary lines that must never be merged into a description
+NOISE_RE = re.compile(
+    r"^\s*(page \d+|total|subtotal|balance|previous balance|amount due|date\s+description)",
+    re.IGNORECASE,
+)
+
+
+def import_pypdf():
+    try:
+        import pypdf
+    except ImportError as e:
+        raise ImportError(
+            "Splitting or extracting statements locally needs pypdf: pip install pypdf"
+        ) from e
+    return pypdf
+
+
+def iter_lines(file_path: str) -> Iterator[str]:
+    """Yield the text lines of a PDF one page at a time."""
+
+    reader = import_pypdf().PdfReader(file_path)
+    for page in reader.pages:
+        yield from (page.extract_text() or "").splitlines()
+
+
+def split_pdf(file_path: str, pages_per_chunk: int, output_dir: str) -> List[str]:
+    """Write the PDF's pages to output_dir as PDFs of pages_per_chunk pages each.
+
+    Returns the chunk paths in page order.
+    """
+
+    pypdf = import_pypdf()
+    reader = pypdf.PdfReader(file_path)
+    name = os.path.splitext(os.path.basename(file_path))[0]
+
+    chunk_paths = []
+    for first_page in range(0, len(reader.pages), pages_per_chunk):
+        writer = pypdf.PdfWriter()
+        for page in reader.pages[first_page : first_page + pages_per_chunk]:
+            writer.add_page(page)
+
+        chunk_path = os.path.join(output_dir, f"{name}.{len(chunk_paths):03d}.pdf")
+        with open(chunk_path, "wb") as chunk_file:
+            writer.write(chunk_file)
+        chunk_paths.append(chunk_path)
+    return chunk_paths
+
+
+def parse_amount(text: str) -> str:
+    negative = text.startswith("(") or "-" in text
+    amount = text.strip("()").replace("$", "").replace("-", "")
+    return f"-{amount}" if negative else amount
+
+
+def statement_end(lines: List[str]) -> Optional[Tuple[int, int]]:
+    """(year, month) of the latest full date on the statement, i.e. the end of its period."""
+
+    dates = []
+    for line in lines:
+        for month, year in FULL_DATE_RE.findall(line):
+            year = int(year) if len(year) == 4 else 2000 + int(year)
+            if 1 <= int(month) <= 12:
+                dates.append((year, int(month)))
+    return max(dates, default=None)
+
+
+def with_year(date: str, end: Optional[Tuple[int, int]]) -> Optional[str]:
+    """A row date with its year, taken from the statement's end for dates like "10/01".
+
+    Months after the end month are from the previous year (a December row on a January
+    statement). None if the year can't be known.
+    """
+
+    if date.count("/") == 2:
+        return date
+    if end is None:
+        return None
+    end_year, end_month = end
+    month = int(date.split("/")[0])
+    return f"{date}/{end_year if month <= end_month else end_year - 1}"
+
+
+def iter_rows(lines) -> Iterator[dict]:
+    """Group statement lines into rows of date, amount and description.
+
+    A row starts at a line beginning with a date, once the row before it has its amount.
+    Other lines are continuations of the open row's description, until the next row or a
+    noise line (page headers, totals), including lines beginning with a date while the
+    row has no amount yet (a wrapped description like "8/10 John Doe court time 30.00").
+    The row's amount is the first amount on its first line that has one; anything after
+    it (e.g. a running balance) is dropped.
+    """
+
+    row = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        match = ROW_START_RE.match(line)
+        # Until the open row has its amount, a line starting with a date is a wrapped
+        # part of its description, not the next row
+        if match and (row is None or row["amount"] is not None):
+            if row is not None:
+                yield row
+            row = {"date": match.group(1), "amount": None, "parts": []}
+            line = match.group(2)
+        elif row is None or NOISE_RE.match(line):
+            if row is not None:
+                yield row
+            row = None
+            continue
+
+        amounts = AMOUNT_RE.findall(line)
+        if amounts and row["amount"] is None:
+            row["amount"] = parse_amount(amounts[0])
+            line = line[: line.find(amounts[0])]
+        row["parts"].append(line.strip())
+
+    if row is not None:
+        yield row
+
+
+def extract_statement(file_path: str) -> pd.DataFrame:
+    """Extract date/amount/description rows from a statement PDF without any network calls.
+
+    Rows dated without a year get the statement's, and are dropped if it has none.
+    """
+
+    lines = list(iter_lines(file_path))
+    end = statement_end(lines)
+
+    rows = []
+    for row in iter_rows(lines):
+        if row["amount"] is None:
+            continue
+        description = " ".join(part for part in row["parts"] if part)
+        date = with_year(row["date"], end)
+        if date is None:
+            logging.warning(
+                f"Skipping row dated {row['date']} with no year on the statement: {description}"
+            )
+            continue
+        rows.append({"date": date, "amount": row["amount"], "description": description})
+    return pd.DataFrame(rows, columns=["date", "amount", "description"])
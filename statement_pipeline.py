@@ -0,0 +1,341 @@
+import logging
+import warnings
+from collections import Counter
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional
+
+import pandas as pd
+import pandas.api.types as ptypes
+
+from assignment_rules import ALL_MEMBERS_KEY, UNKNOWN_MEMBER_KEY, Assignment_rules
+from expense import Expense, key_from_api
+from member_cache import Name_index
+from parse_cache import Parse_cache
+from parse_config import (
+    ASSISTANT_PARSE_MODE,
+    DEFAULT_PAGES_PER_CHUNK,
+    DEFAULT_PARALLEL_CHUNKS,
+    DEFAULT_PARSE_MODE,
+)
+from run_metrics import Run_metrics
+from splitwise_client import Splitwise_client
+from statement_extractor import extract_statement
+from statement_rows import build_expenses
+
+if TYPE_CHECKING:
+    from assignment_memory import Learned_assignments
+    from bayclub_statement_parser import Row
+
+# bayclub_statement_parser (and so openai) is only imported by the functions that call GPT,
+# so processing an already-parsed statement never pays for it.
+
+
+def parse_dates(dates: pd.Series) -> pd.Series:
+    """Parse a column of dates, giving NaT for anything unparseable."""
+
+    # The fast path infers one format for the whole column...
+    with warnings.catch_warnings():
+        # ...and warns when it can't, which the fallback below takes care of
+        warnings.simplefilter("ignore", UserWarning)
+        parsed = pd.to_datetime(dates, errors="coerce")
+
+    # ...so rows in any other format are parsed one by one
+    retry = parsed.isna() & dates.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(dates[retry], errors="coerce", format="mixed")
+    return parsed
+
+
+def log_rows(level: int, message: str, statement: pd.DataFrame, mask):
+    """Log each row selected by mask, skipping the formatting work if nobody's listening."""
+
+    if not logging.getLogger().isEnabledFor(level):
+        return
+    for position in mask.nonzero()[0]:
+        logging.log(level, f"{message}: {statement.iloc[position]}")
+
+
+def process_statement(
+    statement: pd.DataFrame,
+    group_id: str,
+    payer_name: str,
+    name_to_id: dict,
+    aliases: Optional[dict] = None,
+) -> List[Expense]:
+    """Process the statement and add expenses using Splitwise user IDs.
+
+    Member names are matched case-insensitively, by first name when it's unique in the
+    group, and through the config's aliases.
+    """
+
+    name_index = Name_index(name_to_id, aliases)
+
+    # Get the payer's user ID from the group member mapping
+    payer_user_id = name_index.resolve(payer_name)
+
+    if not payer_user_id:
+        raise ValueError(f"Error: Payer '{payer_name}' not found in the group!")
+
+    statement.columns = statement.columns.str.lower()
+    if not ptypes.is_numeric_dtype(statement["amount"]):
+        statement["amount"] = pd.to_numeric(
+            statement["amount"].str.replace(",", ""), errors="coerce"
+        )
+
+    costs = statement["amount"]
+    members = statement["assigned_member"]
+    dates = parse_dates(statement["date"])
+
+    # Skip rows where the cost is negative or NaN
+    valid_cost = (costs.notna() & (costs > 0)).to_numpy()
+    log_rows(logging.WARNING, "Skipping row with invalid cost", statement, ~valid_cost)
+
+    # Skip rows whose date can't be parsed into the required YYYY-MM-DD format
+    valid_date = dates.notna().to_numpy()
+    log_rows(
+        logging.ERROR,
+        "Error: Invalid date format for row",
+        statement,
+        valid_cost & ~valid_date,
+    )
+
+    # Skip rows assigned to someone who isn't in the group
+    is_all = (members == ALL_MEMBERS_KEY).to_numpy()
+    # Resolve each distinct name once. object dtype keeps the user IDs as ints instead of
+    # upcasting them to float.
+    member_ids = {member: name_index.resolve(member) for member in members.unique()}
+    other_member_ids = members.map(pd.Series(member_ids, dtype=object))
+    valid_member = is_all | other_member_ids.notna().to_numpy()
+    unknown_members = members[valid_cost & valid_date & ~valid_member]
+    if logging.getLogger().isEnabledFor(logging.ERROR):
+        for member in unknown_members:
+            logging.error(
+                f"Error: Could not find member '{member}' in the group. Known members are {name_to_id}"
+            )
+
+    keep = valid_cost & valid_date & valid_member
+    rows = statement[keep]
+    return build_expenses(
+        rows["amount"].to_numpy(),
+        rows["description"].tolist(),
+        dates[keep].dt.strftime("%Y-%m-%d").tolist(),
+        is_all[keep].tolist(),
+        other_member_ids[keep].tolist(),
+        rows["reason"].tolist(),
+        group_id,
+        payer_user_id,
+        name_to_id,
+    )
+
+
+def filter_new_expenses(
+    splitwise_client: Splitwise_client, expenses: List[Expense], group_id
+) -> List[Expense]:
+    """Drop expenses that already exist in the group, so re-running an upload is safe.
+
+    Existing expenses are fetched once, for the statement's date range, and matched on
+    (date, cost, description, shares). Identical charges are matched one-for-one, so a
+    statement with two identical court fees still uploads the second if only one exists.
+    """
+
+    if not expenses:
+        return []
+
+    dates = [expense.date for expense in expenses]
+    # One day of margin on both sides, so the first and last days are fetched whether the
+    # API's bounds are inclusive or not
+    day_before = (pd.Timestamp(min(dates)) - pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+    day_after = (pd.Timestamp(max(dates)) + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+    existing = Counter(
+        key_from_api(expense)
+        for expense in splitwise_client.iter_expenses(
+            group_id, dated_after=day_before, dated_before=day_after
+        )
+        if not expense.get("deleted_at")
+    )
+
+    new_expenses = []
+    for expense in expenses:
+        key = expense.key()
+        if existing[key] > 0:
+            existing[key] -= 1
+        else:
+            new_expenses.append(expense)
+
+    logging.info(
+        f"{len(expenses) - len(new_expenses)}/{len(expenses)} expenses are already in the group"
+    )
+    return new_expenses
+
+
+def apply_learned(
+    statement: pd.DataFrame, learned: Optional["Learned_assignments"]
+) -> pd.DataFrame:
+    """Assign the rows the rules left ambiguous from past expenses, where they agree."""
+
+    if learned is None or not len(learned):
+        return statement
+    ambiguous = statement["ambiguous"].sum()
+    statement = learned.apply(statement)
+    logging.info(
+        f"Past expenses assigned {ambiguous - statement['ambiguous'].sum()}/{ambiguous} "
+        "rows the rules couldn't"
+    )
+    return statement
+
+
+def extract_local(
+    statement_pdf: str,
+    members: list,
+    offline: bool,
+    metrics: Optional[Run_metrics] = None,
+    learned: Optional["Learned_assignments"] = None,
+) -> pd.DataFrame:
+    """Extract rows without GPT, assign them by rule or from past expenses, and ask GPT only about the rest."""
+
+    statement = Assignment_rules(members).apply(extract_statement(statement_pdf))
+    statement = apply_learned(statement, learned)
+    ambiguous = statement[statement["ambiguous"]]
+    logging.info(f"Extracted {len(statement)} rows, {len(ambiguous)} need GPT")
+
+    if offline or ambiguous.empty:
+        statement.loc[statement["ambiguous"], "assigned_member"] = UNKNOWN_MEMBER_KEY
+        statement.loc[statement["ambiguous"], "reason"] = "No rule matched"
+        return statement
+
+    from bayclub_statement_parser import Bayclub_statement_parser
+
+    statement_parser = Bayclub_statement_parser(members=members, metrics=metrics)
+    assignments = statement_parser.assign_members(ambiguous["description"].tolist())
+    statement.loc[ambiguous.index, "assigned_member"] = [
+        a.assigned_member for a in assignments
+    ]
+    statement.loc[ambiguous.index, "reason"] = [a.reason for a in assignments]
+    return statement
+
+
+def load_parsed_statement(path: str) -> pd.DataFrame:
+    """Load an already-parsed statement from a JSON (list of rows) or CSV file."""
+
+    if path.lower().endswith(".csv"):
+        return pd.read_csv(path, dtype=str, keep_default_na=False)
+    return pd.read_json(path, orient="records", dtype=False, convert_dates=False)
+
+
+def cached_statement(
+    statement_pdf: str,
+    members: list,
+    parse_mode: str = DEFAULT_PARSE_MODE,
+    learned: Optional["Learned_assignments"] = None,
+) -> Optional[pd.DataFrame]:
+    """The statement's cached parse, assigned like parse_statement does, or None if it isn't cached."""
+
+    parse_cache = Parse_cache()
+    statement = parse_cache.get(parse_cache.key(statement_pdf, members, parse_mode))
+    if statement is None:
+        return None
+    return apply_learned(Assignment_rules(members).apply(statement), learned)
+
+
+def parse_statement(
+    statement_pdf: str,
+    members: list,
+    local_extract: bool = False,
+    offline: bool = False,
+    refresh_parse: bool = False,
+    pages_per_chunk: int = DEFAULT_PAGES_PER_CHUNK,
+    parallel_chunks: int = DEFAULT_PARALLEL_CHUNKS,
+    parse_mode: str = DEFAULT_PARSE_MODE,
+    metrics: Optional[Run_metrics] = None,
+    learned: Optional["Learned_assignments"] = None,
+) -> pd.DataFrame:
+    """Turn a statement PDF into a DataFrame of assigned rows."""
+
+    if local_extract:
+        return extract_local(statement_pdf, members, offline, metrics, learned)
+
+    parse_cache = Parse_cache()
+    cache_key = parse_cache.key(statement_pdf, members, parse_mode)
+    parsed_statement = None if refresh_parse else parse_cache.get(cache_key)
+
+    if parsed_statement is not None:
+        logging.info("Using cached parse of this statement.")
+    else:
+        from bayclub_statement_parser import Bayclub_statement_parser
+
+        # Upload file and create assistant
+        statement_parser = Bayclub_statement_parser(
+            members=members, parse_mode=parse_mode, metrics=metrics
+        )
+        if pages_per_chunk > 0:
+            parsed_statement = statement_parser.parse_in_chunks(
+                statement_pdf, pages_per_chunk, max_workers=parallel_chunks
+            )
+        else:
+            parsed_statement = statement_parser.parse(statement_pdf)
+        parse_cache.put(cache_key, parsed_statement)
+
+        logging.info("Got parsed statement. Thank you GPT <3")
+
+    # GPT's assignments are only kept for rows the deterministic rules can't decide
+    parsed_statement = Assignment_rules(members).apply(parsed_statement)
+    logging.info(
+        f"Rules assigned {(~parsed_statement['ambiguous']).sum()}/{len(parsed_statement)} rows"
+    )
+    # ...and past expenses' assignments are preferred to GPT's for the rest
+    return apply_learned(parsed_statement, learned)
+
+
+def stream_rows(
+    statement_pdf: str,
+    members: list,
+    refresh_parse: bool = False,
+    metrics: Optional[Run_metrics] = None,
+) -> Iterator["Row"]:
+    """Yield the statement's rows as GPT produces them, caching the parse once it's complete."""
+
+    from bayclub_statement_parser import Bayclub_statement_parser, Row
+
+    parse_cache = Parse_cache()
+    # Streaming always goes through the assistant
+    cache_key = parse_cache.key(statement_pdf, members, ASSISTANT_PARSE_MODE)
+    cached_statement = None if refresh_parse else parse_cache.get(cache_key)
+
+    if cached_statement is not None:
+        logging.info("Using cached parse of this statement.")
+        cached_statement.columns = cached_statement.columns.str.lower()
+        for record in cached_statement.to_dict("records"):
+            yield Row.model_validate(
+                {field: str(record.get(field, "")) for field in Row.model_fields}
+            )
+        return
+
+    statement_parser = Bayclub_statement_parser(members=members, metrics=metrics)
+    rows = []
+    for row in statement_parser.iter_parse(statement_pdf):
+        rows.append(row)
+        yield row
+
+    parse_cache.put(cache_key, pd.DataFrame([row.model_dump() for row in rows]))
+    logging.info(f"Got all {len(rows)} rows. Thank you GPT <3")
+
+
+def stream_expenses(
+    rows: Iterable["Row"],
+    members: list,
+    group_id: str,
+    payer_name: str,
+    name_to_id: dict,
+    aliases: Optional[dict] = None,
+    learned: Optional["Learned_assignments"] = None,
+) -> Iterator[Expense]:
+    """Apply the assignment rules, past expenses and process_statement to each row as it arrives."""
+
+    assignment_rules = Assignment_rules(members)
+    for row in rows:
+        statement = assignment_rules.apply(pd.DataFrame([row.model_dump()]))
+        if learned is not None:
+            statement = learned.apply(statement)
+        for expense in process_statement(
+            statement, group_id, payer_name, name_to_id, aliases
+        ):
+            yield expense
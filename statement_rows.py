@@ -0,0 +1,196 @@
+import csv
+import datetime
+import json
+import logging
+import math
+from typing import TYPE_CHECKING, List, Optional
+
+from assignment_rules import ALL_MEMBERS_KEY, UNKNOWN_MEMBER_KEY, Assignment_rules
+from expense import Expense
+from member_cache import Name_index
+from money import split_evenly, to_cents
+
+if TYPE_CHECKING:
+    from assignment_memory import Learned_assignments
+
+# Turning parsed rows into expenses without pandas, which takes about half a second to
+# import. process_statement (statement_pipeline.py) builds its expenses here too, so the
+# two only differ in how they read the rows.
+
+# Date formats parsed without pandas. Anything else (including two-digit years, whose
+# century pandas picks differently) is left to pd.to_datetime.
+DATE_FORMATS = ["%m/%d/%Y", "%Y-%m-%d"]
+
+
+def build_expenses(
+    amounts,
+    descriptions: List[str],
+    dates: List[str],
+    is_all: List[bool],
+    member_ids: List[Optional[int]],
+    details: List[str],
+    group_id: str,
+    payer_user_id: int,
+    name_to_id: dict,
+) -> List[Expense]:
+    """Expenses for valid rows: dollar amounts, YYYY-MM-DD dates and resolved member IDs.
+
+    The payer pays for everything. "All" rows are split equally among all members (except
+    "Unknown"), in exact cents that always add up to the charged amount; other rows are
+    owed in full by their member.
+    """
+
+    cost_cents = to_cents(amounts).tolist()
+
+    actual_members = {k: v for k, v in name_to_id.items() if k != UNKNOWN_MEMBER_KEY}
+    all_costs = [cost for cost, all_row in zip(cost_cents, is_all) if all_row]
+    all_shares = iter(split_evenly(all_costs, len(actual_members)).tolist())
+
+    # Every "All" row shares one user_ids tuple. The payer is matched by ID, since
+    # payer_name may be a first name, an alias or differently cased.
+    all_member_ids = tuple(actual_members.values())
+    all_member_is_payer = [
+        member_id == payer_user_id for member_id in actual_members.values()
+    ]
+
+    expenses = []
+    for cost, description, date, all_row, other_id, detail in zip(
+        cost_cents, descriptions, dates, is_all, member_ids, details
+    ):
+        if all_row:
+            user_ids = all_member_ids
+            paid = tuple(cost if is_payer else 0 for is_payer in all_member_is_payer)
+            owed_shares = tuple(next(all_shares))
+        elif other_id == payer_user_id:
+            # The payer's own charge
+            user_ids, paid, owed_shares = (payer_user_id,), (cost,), (cost,)
+        else:
+            # Payer pays the full amount, the other member owes the full cost
+            user_ids = (payer_user_id, other_id)
+            paid, owed_shares = (cost, 0), (0, cost)
+
+        expenses.append(
+            Expense(
+                cost, description, date, group_id, user_ids, paid, owed_shares, detail
+            )
+        )
+
+    return expenses
+
+
+def load_rows(path: str) -> List[dict]:
+    """Read a parsed statement (a JSON list of rows, or a CSV), with lower-cased keys."""
+
+    with open(path, "r", newline="") as file:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(file))
+        else:
+            rows = json.load(file)
+    return [{str(key).lower(): value for key, value in row.items()} for row in rows]
+
+
+def parse_amount(amount) -> Optional[float]:
+    """A row's amount in dollars, or None (like pd.to_numeric's NaN) if it isn't a number."""
+
+    if isinstance(amount, bool):
+        return None
+    if isinstance(amount, (int, float)):
+        return float(amount)
+    try:
+        return float(str(amount).replace(",", ""))
+    except ValueError:
+        return None
+
+
+def parse_date(date) -> Optional[str]:
+    """A row's date as YYYY-MM-DD, or None if it isn't in one of DATE_FORMATS."""
+
+    for date_format in DATE_FORMATS:
+        try:
+            return (
+                datetime.datetime.strptime(str(date).strip(), date_format)
+                .date()
+                .isoformat()
+            )
+        except ValueError:
+            continue
+    return None
+
+
+def process_rows(
+    rows: List[dict],
+    group_id: str,
+    payer_name: str,
+    name_to_id: dict,
+    aliases: Optional[dict] = None,
+    learned: Optional["Learned_assignments"] = None,
+) -> Optional[List[Expense]]:
+    """Assign rows and turn them into expenses like parse_statement and process_statement.
+
+    Returns None if any row has a date in a format only pandas can parse (or the rows
+    aren't shaped like a statement), so the caller can fall back to the pandas path.
+    """
+
+    if not all(
+        isinstance(row, dict) and {"date", "amount", "description"} <= row.keys()
+        for row in rows
+    ):
+        return None
+
+    name_index = Name_index(name_to_id, aliases)
+    payer_user_id = name_index.resolve(payer_name)
+    if not payer_user_id:
+        raise ValueError(f"Error: Payer '{payer_name}' not found in the group!")
+
+    members = [name for name in name_to_id if name != UNKNOWN_MEMBER_KEY]
+    rules = Assignment_rules(members)
+
+    valid = {
+        "amounts": [],
+        "descriptions": [],
+        "dates": [],
+        "is_all": [],
+        "member_ids": [],
+        "details": [],
+    }
+    for row in rows:
+        date = parse_date(row["date"])
+        if date is None and row["date"] not in (None, ""):
+            return None
+
+        # The rules decide where they can, then past expenses, then GPT's assignment
+        assignment = rules.assign(row["description"])
+        if assignment is None and learned is not None:
+            assignment = learned.assign(row["description"])
+        member, reason = assignment or (
+            row.get("assigned_member", UNKNOWN_MEMBER_KEY),
+            row.get("reason", ""),
+        )
+
+        amount = parse_amount(row["amount"])
+        if amount is None or math.isnan(amount) or amount <= 0:
+            logging.warning(f"Skipping row with invalid cost: {row}")
+            continue
+        if date is None:
+            logging.error(f"Error: Invalid date format for row: {row}")
+            continue
+        member_id = None if member == ALL_MEMBERS_KEY else name_index.resolve(member)
+        if member != ALL_MEMBERS_KEY and member_id is None:
+            logging.error(
+                f"Error: Could not find member '{member}' in the group. Known members are {name_to_id}"
+            )
+            continue
+
+        valid["amounts"].append(amount)
+        valid["descriptions"].append(row["description"])
+        valid["dates"].append(date)
+        valid["is_all"].append(member == ALL_MEMBERS_KEY)
+        valid["member_ids"].append(member_id)
+        valid["details"].append(reason)
+
+    return build_expenses(
+        group_id=group_id,
+        payer_user_id=payer_user_id,
+        name_to_id=name_to_id,
+        **valid,
+    )
@@ -0,0 +1,400 @@
+import datetime
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from typing import TYPE_CHECKING, List, Optional
+
+from assignment_rules import normalize_name
+from expense import Expense
+
+# pandas (and pyarrow) are only imported when the store is used, so the CLI can take its
+# defaults from here without slowing down every command
+if TYPE_CHECKING:
+    import pandas as pd
+
+DEFAULT_STORE_DIR = ".statement_store"
+
+# A row's upload status. Rows start out pending and are updated as they're uploaded.
+PENDING = "pending"
+UPLOADED = "uploaded"
+FAILED = "failed"
+# process_statement couldn't turn the row into an expense (bad date/amount/member)
+SKIPPED = "skipped"
+# --sync found the expense already in the group
+DUPLICATE = "duplicate"
+UPLOAD_STATUSES = [PENDING, UPLOADED, FAILED, SKIPPED, DUPLICATE]
+
+# Identifies a row across versions of the store's records
+KEY_COLUMNS = ["statement_hash", "row_index"]
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            "The statement store needs pyarrow: pip install pyarrow"
+        ) from e
+    return pyarrow
+
+
+def schema():
+    pa = import_pyarrow()
+    return pa.schema(
+        [
+            # SHA-256 of the statement PDF (or parsed statement file)
+            ("statement_hash", pa.string()),
+            ("source", pa.string()),
+            ("row_index", pa.int32()),
+            # Null when the statement's date or amount couldn't be parsed
+            ("date", pa.date32()),
+            ("amount_cents", pa.int64()),
+            ("description", pa.string()),
+            ("assigned_member", pa.string()),
+            ("reason", pa.string()),
+            # Whether the assignment rules left the row to GPT
+            ("ambiguous", pa.bool_()),
+            ("group_id", pa.string()),
+            ("parse_mode", pa.string()),
+            # When this version of the statement was parsed. A statement's rows are those
+            # of its latest version.
+            ("parsed_at", pa.timestamp("us", tz="UTC")),
+            # When this record was written. A row's latest record wins.
+            ("recorded_at", pa.timestamp("us", tz="UTC")),
+            ("upload_status", pa.string()),
+            ("expense_id", pa.int64()),
+        ]
+    )
+
+
+def row_key(date, amount_cents, description) -> tuple:
+    """Matches a stored row with the expense process_statement made from it."""
+
+    return (str(date), amount_cents, str(description).strip())
+
+
+def expense_key(expense: Expense) -> tuple:
+    return row_key(expense.date, expense.cost_cents, expense.description)
+
+
+class Statement_store:
+    """Every parsed row, with its assignment and upload status, in a directory of Parquet files.
+
+    The store is append-only: each run writes a new file, and a row's upload status is
+    updated by writing a newer record of it, so concurrent runs never touch each other's
+    files. compact() folds the history into a single file.
+    """
+
+    def __init__(self, store_dir: str = DEFAULT_STORE_DIR):
+        import_pyarrow()
+        self.store_dir = store_dir
+        self.lock = threading.Lock()
+
+    def _paths(self) -> List[str]:
+        if not os.path.isdir(self.store_dir):
+            return []
+        return sorted(
+            os.path.join(self.store_dir, name)
+            for name in os.listdir(self.store_dir)
+            if name.startswith("part-") and name.endswith(".parquet")
+        )
+
+    def _write(self, records: "pd.DataFrame") -> Optional[str]:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if records.empty:
+            return None
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        name = f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet"
+        path = os.path.join(self.store_dir, name)
+        # Only part-*.parquet files are read, so a half-written file never is
+        tmp_path = os.path.join(self.store_dir, f"{name}.tmp")
+        table = pa.Table.from_pandas(
+            records[schema().names], schema=schema(), preserve_index=False
+        )
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    def _read(
+        self, statement_hash: Optional[str] = None, paths: Optional[List[str]] = None
+    ) -> "pd.DataFrame":
+        """The latest record of every current row, optionally of one statement only.
+
+        Reads paths, or every file in the store.
+        """
+
+        import pyarrow.dataset as ds
+
+        if paths is None:
+            paths = self._paths()
+        if not paths:
+            return schema().empty_table().to_pandas()
+
+        dataset = ds.dataset(paths, format="parquet", schema=schema())
+        # Row keys never change, so filtering on them before de-duplicating is safe
+        expression = None
+        if statement_hash is not None:
+            expression = ds.field("statement_hash") == statement_hash
+        records = dataset.to_table(filter=expression).to_pandas()
+        # Nullable integers would otherwise come back as floats
+        records = records.astype({"amount_cents": "Int64", "expense_id": "Int64"})
+        if records.empty:
+            return records
+
+        # Only the latest version of each statement...
+        latest_version = records.groupby("statement_hash")["parsed_at"].transform("max")
+        records = records[records["parsed_at"] == latest_version]
+        # ...and the latest record of each of its rows
+        records = records.sort_values("recorded_at", kind="stable")
+        records = records.drop_duplicates(KEY_COLUMNS, keep="last")
+        return records.sort_values(KEY_COLUMNS, kind="stable").reset_index(drop=True)
+
+    def append(
+        self,
+        statement: "pd.DataFrame",
+        statement_path: str,
+        group_id,
+        parse_mode: str,
+    ) -> "pd.DataFrame":
+        """Record a statement parsed from statement_path as a new version. Returns the stored rows.
+
+        Rows that were already stored for this statement keep their upload status, so
+        re-running a statement never forgets what was uploaded.
+        """
+
+        import pandas as pd
+
+        from money import to_cents
+        from parse_cache import hash_file
+        from statement_pipeline import parse_dates
+
+        statement_hash = hash_file(statement_path)
+        source = os.path.basename(statement_path)
+
+        statement = statement.copy()
+        statement.columns = statement.columns.str.lower()
+        amounts = statement["amount"]
+        if not pd.api.types.is_numeric_dtype(amounts):
+            amounts = pd.to_numeric(
+                amounts.astype(str).str.replace(",", ""), errors="coerce"
+            )
+        now = pd.Timestamp.now(tz="UTC")
+
+        records = pd.DataFrame(
+            {
+                "statement_hash": statement_hash,
+                "source": source,
+                "row_index": range(len(statement)),
+                "date": parse_dates(statement["date"].astype(str)).dt.date.to_numpy(),
+                "amount_cents": pd.array(to_cents(amounts.fillna(0)), dtype="Int64"),
+                "description": statement["description"].astype(str).to_numpy(),
+                "assigned_member": statement["assigned_member"].astype(str).to_numpy(),
+                "reason": statement.get("reason", pd.Series("", index=statement.index))
+                .fillna("")
+                .astype(str)
+                .to_numpy(),
+                "ambiguous": statement.get(
+                    "ambiguous", pd.Series(False, index=statement.index)
+                )
+                .astype(bool)
+                .to_numpy(),
+                "group_id": str(group_id),
+                "parse_mode": parse_mode,
+                "parsed_at": now,
+                "recorded_at": now,
+                "upload_status": PENDING,
+                "expense_id": pd.array([None] * len(statement), dtype="Int64"),
+            }
+        )
+        records["date"] = records["date"].where(records["date"].notna(), None)
+        records.loc[amounts.isna().to_numpy(), "amount_cents"] = pd.NA
+
+        with self.lock:
+            previous = self._read(statement_hash)
+            done = previous[previous["upload_status"] != PENDING].reset_index(drop=True)
+            if not done.empty:
+                carried = match_rows(
+                    done,
+                    [
+                        row_key(date, amount, description)
+                        for date, amount, description in zip(
+                            records["date"],
+                            records["amount_cents"],
+                            records["description"],
+                        )
+                    ],
+                )
+                for position, previous_position in enumerate(carried):
+                    if previous_position is None:
+                        continue
+                    source_row = done.iloc[previous_position]
+                    records.at[position, "upload_status"] = source_row["upload_status"]
+                    records.at[position, "expense_id"] = source_row["expense_id"]
+            self._write(records)
+
+        logging.info(f"Stored {len(records)} rows of {source} in {self.store_dir}")
+        return records
+
+    def record_uploads(
+        self,
+        rows: "pd.DataFrame",
+        expenses: List[Expense],
+        results: Optional[list] = None,
+    ):
+        """Update the status of stored rows after processing and uploading them.
+
+        expenses are everything process_statement made from the rows, and results the
+        Upload_results of the ones that were uploaded. Rows without an expense are
+        skipped; expenses without a result were already in the group (--sync).
+        """
+
+        import pandas as pd
+
+        uploaded = {}
+        for result in results or []:
+            uploaded.setdefault(expense_key(result.expense), deque()).append(result)
+
+        updates = rows.copy()
+        positions = match_rows(rows, [expense_key(expense) for expense in expenses])
+        matched = set()
+        for expense, position in zip(expenses, positions):
+            if position is None:
+                continue
+            matched.add(position)
+            pending_results = uploaded.get(expense_key(expense))
+            result = pending_results.popleft() if pending_results else None
+            if result is None:
+                if updates.iloc[position]["upload_status"] == UPLOADED:
+                    # Already recorded as uploaded by an earlier run
+                    continue
+                status, expense_id = DUPLICATE, None
+            elif result.success:
+                status, expense_id = UPLOADED, result.expense_id
+            else:
+                status, expense_id = FAILED, None
+            updates.iloc[position, updates.columns.get_loc("upload_status")] = status
+            updates.iloc[position, updates.columns.get_loc("expense_id")] = expense_id
+            updates.iloc[position, updates.columns.get_loc("group_id")] = str(
+                expense.group_id
+            )
+
+        unmatched = [
+            position for position in range(len(updates)) if position not in matched
+        ]
+        updates.iloc[unmatched, updates.columns.get_loc("upload_status")] = SKIPPED
+        updates["recorded_at"] = pd.Timestamp.now(tz="UTC")
+
+        with self.lock:
+            self._write(updates)
+
+    def query(
+        self,
+        member: Optional[str] = None,
+        since: Optional[datetime.date] = None,
+        until: Optional[datetime.date] = None,
+        description: Optional[str] = None,
+        statement_hash: Optional[str] = None,
+        upload_statuses: Optional[List[str]] = None,
+    ) -> "pd.DataFrame":
+        """Current rows matching every given filter, in statement and row order.
+
+        member matches the assigned member case-insensitively, since/until are inclusive,
+        description is a case-insensitive regular expression, and statement_hash may be
+        a prefix of the hash.
+        """
+
+        import pandas as pd
+
+        rows = self._read()
+        dates = pd.to_datetime(rows["date"])
+        keep = pd.Series(True, index=rows.index)
+        if member is not None:
+            keep &= rows["assigned_member"].map(normalize_name) == normalize_name(
+                member
+            )
+        if since is not None:
+            keep &= dates >= pd.Timestamp(since)
+        if until is not None:
+            keep &= dates <= pd.Timestamp(until)
+        if description is not None:
+            keep &= rows["description"].str.contains(
+                description, case=False, regex=True
+            )
+        if statement_hash is not None:
+            keep &= rows["statement_hash"].str.startswith(statement_hash)
+        if upload_statuses:
+            keep &= rows["upload_status"].isin(upload_statuses)
+        return rows[keep].reset_index(drop=True)
+
+    def compact(self) -> int:
+        """Rewrite the store as one file of current rows. Returns the number of rows kept.
+
+        Only the files listed up front are folded in and removed, so files that other
+        runs write meanwhile are kept, and their newer records still win. If this is
+        interrupted, the old files are left next to the new one, which is harmless.
+        """
+
+        with self.lock:
+            old_paths = self._paths()
+            rows = self._read(paths=old_paths)
+            self._write(rows)
+            for path in old_paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Another compaction got to it first
+                    pass
+        return len(rows)
+
+
+def match_rows(rows: "pd.DataFrame", keys: List[tuple]) -> List[Optional[int]]:
+    """The position in rows matching each key, or None. Identical rows are matched one-for-one."""
+
+    import pandas as pd
+
+    candidates = defaultdict(deque)
+    for position, (date, amount, description) in enumerate(
+        zip(rows["date"], rows["amount_cents"], rows["description"])
+    ):
+        if pd.isna(date) or pd.isna(amount):
+            continue
+        candidates[row_key(date, int(amount), description)].append(position)
+
+    return [candidates[key].popleft() if candidates.get(key) else None for key in keys]
+
+
+def to_statement(rows: "pd.DataFrame") -> "pd.DataFrame":
+    """Stored rows as a statement DataFrame that process_statement accepts."""
+
+    import pandas as pd
+
+    return pd.DataFrame(
+        {
+            "date": [None if pd.isna(date) else str(date) for date in rows["date"]],
+            "amount": rows["amount_cents"].astype("Float64").to_numpy(dtype=float)
+            / 100,
+            "description": rows["description"].to_numpy(),
+            "assigned_member": rows["assigned_member"].to_numpy(),
+            "reason": rows["reason"].to_numpy(),
+        }
+    )
+
+
+def open_statement_store(store_dir: Optional[str]) -> Optional[Statement_store]:
+    """The store at store_dir, or None (with a warning) if pyarrow isn't installed."""
+
+    if not store_dir:
+        return None
+    try:
+        return Statement_store(store_dir)
+    except ImportError as e:
+        logging.warning(f"Not recording parsed rows: {e}")
+        return None
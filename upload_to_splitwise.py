@@ -1,27 +1,138 @@
 import argparse
+import atexit
+import datetime
 import json
 import logging
 import pprint
+import sys
+from typing import List
+
+from assignment_memory import DEFAULT_MEMORY_PATH, Assignment_memory
+from assignment_rules import UNKNOWN_MEMBER_KEY
+from member_cache import DEFAULT_TTL_SECONDS, Member_cache, Name_index
+from parse_config import (
+    ASSISTANT_PARSE_MODE,
+    DEFAULT_PAGES_PER_CHUNK,
+    DEFAULT_PARALLEL_CHUNKS,
+    DEFAULT_PARSE_MODE,
+    LOCAL_PARSE_MODE,
+    PARSE_MODES,
+)
+from run_metrics import Run_metrics, write_metrics
+from splitwise_client import (
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_QUEUE_SIZE,
+    Splitwise_client,
+    UploadInterruptedError,
+    load_secrets,
+)
+from statement_store import (
+    DEFAULT_STORE_DIR,
+    DUPLICATE,
+    UPLOAD_STATUSES,
+    UPLOADED,
+    open_statement_store,
+)
 
-import pandas as pd
-import pandas.api.types as ptypes
-
-from bayclub_statement_parser import Bayclub_statement_parser
-from splitwise_client import Splitwise_client
+# pandas, openai and the rest of the pipeline are imported by the subcommands that need
+# them (see statement_pipeline.py), so quick checks start fast.
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-UNKNOWN_MEMBER_KEY = "Unknown"
-ALL_MEMBERS_KEY = "All"
+UPLOAD_COMMAND = "upload"
+PREVIEW_COMMAND = "preview"
+VALIDATE_CONFIG_COMMAND = "validate-config"
+QUERY_COMMAND = "query"
+REPLAY_COMMAND = "replay"
+LEARN_COMMAND = "learn"
+COMPACT_COMMAND = "compact"
+COMMANDS = [
+    UPLOAD_COMMAND,
+    PREVIEW_COMMAND,
+    VALIDATE_CONFIG_COMMAND,
+    QUERY_COMMAND,
+    REPLAY_COMMAND,
+    LEARN_COMMAND,
+    COMPACT_COMMAND,
+]
+
+
+def add_member_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--refresh-members",
+        action="store_true",
+        help="Fetch the group's members from Splitwise even if they're cached",
+    )
+    parser.add_argument(
+        "--members-ttl",
+        type=float,
+        default=DEFAULT_TTL_SECONDS,
+        help="How long (in seconds) cached group members stay fresh.",
+    )
 
 
-def parse_args() -> argparse.Namespace:
-    parser = argparse.ArgumentParser(
-        description="Parse a bayclub statement and upload charges to splitwise"
+def add_store_argument(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--store",
+        type=str,
+        default=DEFAULT_STORE_DIR,
+        help="The statement store: a directory of Parquet files with every parsed row, "
+        "its assignment and its upload status.",
     )
 
+
+def add_memory_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--assignment-memory",
+        type=str,
+        default=DEFAULT_MEMORY_PATH,
+        help="Assignments learned from past expenses (see the learn command), used for "
+        "rows the rules can't decide before falling back to GPT.",
+    )
+    parser.add_argument(
+        "--no-assignment-memory",
+        action="store_true",
+        help="Don't use learned assignments",
+    )
+
+
+def add_store_query_arguments(parser: argparse.ArgumentParser):
+    add_store_argument(parser)
+    parser.add_argument(
+        "--member", type=str, help="Only rows assigned to this member (or All)."
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.date.fromisoformat,
+        help="Only rows dated on or after this YYYY-MM-DD date.",
+    )
+    parser.add_argument(
+        "--until",
+        type=datetime.date.fromisoformat,
+        help="Only rows dated on or before this YYYY-MM-DD date.",
+    )
+    parser.add_argument(
+        "--description",
+        type=str,
+        help="Only rows whose description matches this (case-insensitive) regex.",
+    )
+    parser.add_argument(
+        "--statement-hash",
+        type=str,
+        help="Only rows of the statement whose hash starts with this.",
+    )
+    parser.add_argument(
+        "--status",
+        choices=UPLOAD_STATUSES,
+        nargs="+",
+        help="Only rows with one of these upload statuses. replay --upload-to-splitwise "
+        f"defaults to every status but {UPLOADED} and {DUPLICATE}.",
+    )
+
+
+def add_upload_arguments(parser: argparse.ArgumentParser):
     # Two positional arguments for file paths
     parser.add_argument(
         "--config", type=str, required=True, help="The path to the config JSON."
@@ -39,108 +150,249 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Uploads to splitwise if specified",
     )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Number of expenses to upload concurrently.",
+    )
 
-    return parser.parse_args()
-
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Only upload expenses that aren't already in the Splitwise group",
+    )
+    add_member_arguments(parser)
+    add_parse_arguments(parser)
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Process and upload each row as soon as GPT produces it, instead of waiting "
+        "for the whole statement",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Parse, process and upload as concurrent stages: expenses are uploaded while "
+        "later chunks (or, with --stream, rows) are still being parsed",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="With --pipeline, how many expenses can wait for an upload worker before "
+        "parsing is held back",
+    )
 
-def process_statement(
-    statement: pd.DataFrame, group_id: str, payer_name: str, name_to_id: dict
-) -> list:
-    """Process the statement and add expenses using Splitwise user IDs."""
+    add_memory_arguments(parser)
+    add_store_argument(parser)
+    parser.add_argument(
+        "--no-store",
+        action="store_true",
+        help="Don't record the parsed rows in the statement store",
+    )
+    add_metrics_arguments(parser)
 
-    # Get the payer's user ID from the group member mapping
-    payer_user_id = name_to_id.get(payer_name)
 
-    if not payer_user_id:
-        raise ValueError(f"Error: Payer '{payer_name}' not found in the group!")
+def add_parse_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--refresh-parse",
+        action="store_true",
+        help="Ignore any cached parse of the statement and ask GPT again",
+    )
+    parser.add_argument(
+        "--parse-mode",
+        choices=PARSE_MODES,
+        default=DEFAULT_PARSE_MODE,
+        help="structured: one schema-constrained chat completion per PDF (or chunk). "
+        "assistant: the assistant writes the rows to a file with code_interpreter.",
+    )
+    parser.add_argument(
+        "--pages-per-chunk",
+        type=int,
+        default=DEFAULT_PAGES_PER_CHUNK,
+        help="Parse the PDF this many pages at a time, concurrently. 0 sends the whole "
+        "PDF in one request.",
+    )
+    parser.add_argument(
+        "--parallel-chunks",
+        type=int,
+        default=DEFAULT_PARALLEL_CHUNKS,
+        help="Number of chunks to parse at the same time.",
+    )
+    parser.add_argument(
+        "--local-extract",
+        action="store_true",
+        help="Extract rows from the PDF locally and only ask GPT about rows the rules can't assign",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="With --local-extract, never call GPT; ambiguous rows are assigned to Unknown",
+    )
 
-    statement.columns = statement.columns.str.lower()
-    if not ptypes.is_numeric_dtype(statement["amount"]):
-        statement["amount"] = pd.to_numeric(
-            statement["amount"].str.replace(",", ""), errors="coerce"
-        )
 
-    # Loop through each row and process the data
-    expenses = []
-    for _, row in statement.iterrows():
-        date = row.date
-        cost = row.amount
-        description = row.description
-        member = row.assigned_member
-        reason = row.reason
-
-        details = reason
-
-        # Skip rows where the cost is negative or NaN
-        if pd.isna(cost) or cost <= 0:
-            logging.warning(f"Skipping row with invalid cost: {row}")
-            continue
-
-        # Parse the date into the required YYYY-MM-DD format
-        try:
-            date_str = pd.to_datetime(date).strftime("%Y-%m-%d")
-        except (ValueError, TypeError):
-            logging.error(f"Error: Invalid date format for row: {row}")
-            continue
-
-        user_shares = {}
-
-        if member == ALL_MEMBERS_KEY:
-            # Split equally among all members (except "Unknown")
-            actual_members = {
-                k: v for k, v in name_to_id.items() if k != UNKNOWN_MEMBER_KEY
-            }
-            num_members = len(actual_members)
-
-            # Calculate each member's share, rounded to 2 decimals
-            # because that's SplitWise's precision
-            owed_amount_per_member = round(cost / num_members, 2)
-
-            rounded_cost = owed_amount_per_member * num_members
-
-            if cost != rounded_cost:
-                details = f"{details}, cost rounded so that individual amounts add up to the total"
-                cost = rounded_cost
-
-            # Assign shares (Payer pays, everyone owes equally)
-            for member_name, member_id in actual_members.items():
-                paid = cost if member_name == payer_name else 0
-                user_shares[member_id] = {"paid": paid, "owed": owed_amount_per_member}
+def add_metrics_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--metrics-json",
+        type=str,
+        help="Write a JSON report of stage timings, Splitwise calls and OpenAI token "
+        "usage/cost to this path.",
+    )
+    parser.add_argument(
+        "--metrics-prometheus",
+        type=str,
+        help="Write the same metrics in the Prometheus text format to this path.",
+    )
 
-        else:
-            # Regular case with known members
-            # Use the payer's user ID and the other member's ID (retrieved from name_to_id)
-            other_member_id = name_to_id.get(member)
-            if not other_member_id:
-                logging.error(
-                    f"Error: Could not find member '{member}' in the group. Known members are {name_to_id}"
-                )
-                continue
 
-            user_shares = {
-                # Payer pays the full amount
-                payer_user_id: {"paid": cost, "owed": 0},
-                other_member_id: {
-                    "paid": 0,
-                    "owed": cost,
-                },  # Other member owes the full cost
-            }
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Parse a bayclub statement and upload charges to splitwise"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
 
-        expenses.append((cost, description, date_str, group_id, user_shares, details))
+    upload_parser = subparsers.add_parser(
+        UPLOAD_COMMAND,
+        help="Parse a statement PDF and (optionally) upload it. The default command.",
+    )
+    add_upload_arguments(upload_parser)
 
-    return expenses
+    preview_parser = subparsers.add_parser(
+        PREVIEW_COMMAND,
+        help="Show how an already-parsed statement would be split, without GPT.",
+    )
+    preview_parser.add_argument(
+        "--config", type=str, required=True, help="The path to the config JSON."
+    )
+    preview_parser.add_argument(
+        "--statement",
+        type=str,
+        required=True,
+        help="A parsed statement as JSON (a list of rows) or CSV, with date, amount, "
+        "description and optionally assigned_member/reason columns. A PDF is looked up "
+        "in the parse cache.",
+    )
+    preview_parser.add_argument(
+        "--parse-mode",
+        choices=PARSE_MODES,
+        default=DEFAULT_PARSE_MODE,
+        help="For a PDF, which parse mode's cached parse to use.",
+    )
+    add_member_arguments(preview_parser)
+    add_memory_arguments(preview_parser)
 
+    validate_parser = subparsers.add_parser(
+        VALIDATE_CONFIG_COMMAND, help="Check a config JSON."
+    )
+    validate_parser.add_argument(
+        "--config", type=str, required=True, help="The path to the config JSON."
+    )
+    validate_parser.add_argument(
+        "--check-members",
+        action="store_true",
+        help="Also check the payer and aliases against the group's members on Splitwise",
+    )
+    add_member_arguments(validate_parser)
 
-if __name__ == "__main__":
-    args = parse_args()
+    query_parser = subparsers.add_parser(
+        QUERY_COMMAND, help="List rows from the statement store."
+    )
+    add_store_query_arguments(query_parser)
+    query_parser.add_argument(
+        "--output",
+        type=str,
+        help="Write the matching rows to this .csv, .json or .parquet file instead of "
+        "printing them.",
+    )
 
-    with open("secrets.json", "r") as file:
-        secrets = json.load(file)
+    replay_parser = subparsers.add_parser(
+        REPLAY_COMMAND,
+        help="Process (and optionally upload) rows from the statement store, without GPT.",
+    )
+    replay_parser.add_argument(
+        "--config", type=str, required=True, help="The path to the config JSON."
+    )
+    add_store_query_arguments(replay_parser)
+    replay_parser.add_argument(
+        "--reapply-rules",
+        action="store_true",
+        help="Re-assign the rows with the current assignment rules, learned assignments "
+        "and group members",
+    )
+    replay_parser.add_argument(
+        "--upload-to-splitwise",
+        action="store_true",
+        help="Uploads to splitwise if specified",
+    )
+    replay_parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Only upload expenses that aren't already in the Splitwise group",
+    )
+    replay_parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="Number of expenses to upload concurrently.",
+    )
+    add_member_arguments(replay_parser)
+    add_memory_arguments(replay_parser)
 
-    splitwise_client = Splitwise_client(secrets)
+    learn_parser = subparsers.add_parser(
+        LEARN_COMMAND,
+        help="Learn assignments from the group's expenses on Splitwise and the statement store.",
+    )
+    learn_parser.add_argument(
+        "--config", type=str, required=True, help="The path to the config JSON."
+    )
+    learn_parser.add_argument(
+        "--assignment-memory",
+        type=str,
+        default=DEFAULT_MEMORY_PATH,
+        help="Where the learned assignments are kept.",
+    )
+    learn_parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Fetch all of the group's expenses again, not just the ones updated since "
+        "the last time",
+    )
+    add_store_argument(learn_parser)
+    add_member_arguments(learn_parser)
 
-    # Load the config JSON to get the group_id and payer name
-    with open(args.config, "r") as config_file:
+    compact_parser = subparsers.add_parser(
+        COMPACT_COMMAND,
+        help="Rewrite the statement store as one file of its current rows.",
+    )
+    add_store_argument(compact_parser)
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # Before subcommands there was only the upload command, so keep accepting its flags alone
+    if argv and argv[0] not in COMMANDS and argv[0] not in ("-h", "--help"):
+        argv = [UPLOAD_COMMAND, *argv]
+
+    args = parser.parse_args(argv)
+    if args.command == UPLOAD_COMMAND:
+        if args.stream and args.sync:
+            upload_parser.error(
+                "--sync needs the whole statement, so it can't be used with --stream"
+            )
+        if args.stream and args.local_extract:
+            upload_parser.error("--stream and --local-extract are mutually exclusive")
+        if args.pipeline and args.sync:
+            upload_parser.error(
+                "--sync needs the whole statement, so it can't be used with --pipeline"
+            )
+        if args.queue_size < 1:
+            upload_parser.error("--queue-size must be at least 1")
+    return args
+
+
+def load_config(config_path: str) -> dict:
+    """Load a config JSON and check it has a group_id and payer_name."""
+
+    with open(config_path, "r") as config_file:
         config = json.load(config_file)
 
     group_id = config.get("group_id", None)
@@ -152,27 +404,463 @@ if __name__ == "__main__":
     if payer_name is None:
         raise ValueError("No payer_name found in the configuration file!")
 
-    # Fetch the group members and create a name-to-ID mapping
-    name_to_id = splitwise_client.get_group_members(group_id)
-    if "Unknown None" in name_to_id:
-        name_to_id[UNKNOWN_MEMBER_KEY] = name_to_id.pop("Unknown None")
+    aliases = config.get("aliases", {})
+    if not isinstance(aliases, dict) or not all(
+        isinstance(alias, str) and isinstance(name, str)
+        for alias, name in aliases.items()
+    ):
+        raise ValueError("aliases must map alias names to member names!")
+
+    return config
+
+
+def get_members(args, splitwise_client: Splitwise_client, group_id) -> dict:
+    """The group's {name: user ID}, from the member cache unless --refresh-members."""
+
+    member_cache = Member_cache(splitwise_client, ttl_seconds=args.members_ttl)
+    if args.refresh_members:
+        member_cache.invalidate(group_id)
+    return member_cache.get(group_id)
+
+
+def print_splits(expenses: List, name_to_id: dict):
+    """One line per expense, followed by who paid and who owes what."""
+
+    id_to_name = {user_id: name for name, user_id in name_to_id.items()}
+    for expense in expenses:
+        print(f"{expense.date}  {expense.cost:>10}  {expense.description}")
+        for user_id, paid, owed in zip(
+            expense.user_ids, expense.paid_cents, expense.owed_cents
+        ):
+            shares = []
+            if paid:
+                shares.append(f"paid {paid / 100:.2f}")
+            if owed:
+                shares.append(f"owes {owed / 100:.2f}")
+            if shares:
+                print(f"    {id_to_name.get(user_id, user_id)}: {', '.join(shares)}")
+
+
+def run_validate_config(args):
+    try:
+        config = load_config(args.config)
+        if args.check_members:
+            name_to_id = get_members(
+                args, Splitwise_client(load_secrets()), config["group_id"]
+            )
+            if not name_to_id:
+                raise ValueError(f"Couldn't fetch group {config['group_id']}'s members")
+            # Checks every alias refers to a member
+            name_index = Name_index(name_to_id, config.get("aliases"))
+            if name_index.resolve(config["payer_name"]) is None:
+                raise ValueError(
+                    f"Payer '{config['payer_name']}' not found in the group! "
+                    f"Known members are {list(name_to_id)}"
+                )
+    except (OSError, ValueError) as e:
+        print(f"{args.config}: {e}")
+        raise SystemExit(1)
+
+    print(f"{args.config}: OK")
+
+
+def get_learned(args, group_id, members: list):
+    """The group's learned assignments, or None with --no-assignment-memory."""
+
+    if args.no_assignment_memory:
+        return None
+    return Assignment_memory(args.assignment_memory).learned(group_id, members)
+
+
+def run_learn(args):
+    splitwise_client = Splitwise_client(load_secrets())
+    config = load_config(args.config)
+    group_id = config["group_id"]
+    name_to_id = get_members(args, splitwise_client, group_id)
+    members = [name for name in name_to_id if name != UNKNOWN_MEMBER_KEY]
+
+    memory = Assignment_memory(args.assignment_memory)
+    fetched = memory.learn_from_splitwise(
+        splitwise_client, group_id, name_to_id, refresh=args.refresh
+    )
+    print(f"Learned from {fetched} new or updated Splitwise expenses.")
+
+    store = open_statement_store(args.store)
+    if store is not None:
+        counted = memory.learn_from_store(store, group_id)
+        print(f"Learned from {counted} stored rows that aren't on Splitwise.")
+
+    learned = memory.learned(group_id, members)
+    print(f"{len(learned)} description patterns can now be assigned without GPT.")
+
+
+def run_preview(args):
+    from statement_rows import load_rows, process_rows
+
+    config = load_config(args.config)
+    name_to_id = get_members(args, Splitwise_client(load_secrets()), config["group_id"])
+    members = [name for name in name_to_id if name != UNKNOWN_MEMBER_KEY]
+
+    learned = get_learned(args, config["group_id"], members)
+    expenses = None
+    if not args.statement.lower().endswith(".pdf"):
+        # Most parsed statements don't need pandas, which takes longer to import than
+        # the rest of the preview takes to run
+        rows = load_rows(args.statement)
+        num_rows = len(rows)
+        expenses = process_rows(
+            rows,
+            config["group_id"],
+            config["payer_name"],
+            name_to_id,
+            config.get("aliases"),
+            learned,
+        )
+
+    if expenses is None:
+        from assignment_rules import Assignment_rules
+        from statement_pipeline import (
+            apply_learned,
+            cached_statement,
+            load_parsed_statement,
+            process_statement,
+        )
+
+        if args.statement.lower().endswith(".pdf"):
+            statement = cached_statement(
+                args.statement, members, args.parse_mode, learned
+            )
+            if statement is None:
+                print(
+                    f"No cached parse of {args.statement} (parse mode {args.parse_mode}). "
+                    "Parse it with the upload command first, or pass a JSON/CSV statement."
+                )
+                raise SystemExit(1)
+        else:
+            statement = apply_learned(
+                Assignment_rules(members).apply(load_parsed_statement(args.statement)),
+                learned,
+            )
+        num_rows = len(statement)
+        expenses = process_statement(
+            statement,
+            config["group_id"],
+            config["payer_name"],
+            name_to_id,
+            config.get("aliases"),
+        )
+
+    print_splits(expenses, name_to_id)
+    print(f"{len(expenses)} expenses from {num_rows} rows.")
+
+
+def query_store(store, args, upload_statuses=None):
+    return store.query(
+        member=args.member,
+        since=args.since,
+        until=args.until,
+        description=args.description,
+        statement_hash=args.statement_hash,
+        upload_statuses=upload_statuses or args.status,
+    )
+
+
+def run_query(args):
+    store = open_statement_store(args.store)
+    if store is None:
+        raise SystemExit(1)
+
+    rows = query_store(store, args)
+    if args.output:
+        if args.output.endswith(".parquet"):
+            rows.to_parquet(args.output, index=False)
+        elif args.output.endswith(".json"):
+            rows.to_json(args.output, orient="records", date_format="iso", indent=4)
+        else:
+            rows.to_csv(args.output, index=False)
+        print(f"Wrote {len(rows)} rows to {args.output}")
+        return
+
+    columns = ["date", "amount_cents", "description", "assigned_member"]
+    columns += ["upload_status", "source"]
+    print(rows[columns].to_string(index=False))
+    print(f"{len(rows)} rows, {rows['amount_cents'].sum() / 100:.2f} in total.")
+
+
+def run_compact(args):
+    store = open_statement_store(args.store)
+    if store is None:
+        raise SystemExit(1)
+
+    num_rows = store.compact()
+    print(f"Compacted {args.store} to {num_rows} rows.")
+
+
+def run_replay(args):
+    from assignment_rules import Assignment_rules
+    from statement_pipeline import apply_learned, filter_new_expenses, process_statement
+    from statement_store import to_statement
+
+    store = open_statement_store(args.store)
+    if store is None:
+        raise SystemExit(1)
+
+    splitwise_client = Splitwise_client(load_secrets())
+    config = load_config(args.config)
+    group_id = config["group_id"]
+    name_to_id = get_members(args, splitwise_client, group_id)
+    members = [name for name in name_to_id if name != UNKNOWN_MEMBER_KEY]
+
+    upload_statuses = None
+    if args.upload_to_splitwise and not args.status:
+        # Rows already in the group are only uploaded again when --status asks for them
+        upload_statuses = [
+            status for status in UPLOAD_STATUSES if status not in (UPLOADED, DUPLICATE)
+        ]
+    rows = query_store(store, args, upload_statuses)
+    statement = to_statement(rows)
+    if args.reapply_rules:
+        statement = apply_learned(
+            Assignment_rules(members).apply(statement),
+            get_learned(args, group_id, members),
+        )
+        rows["assigned_member"] = statement["assigned_member"].to_numpy()
+        rows["reason"] = statement["reason"].to_numpy()
+
+    expenses = process_statement(
+        statement, group_id, config["payer_name"], name_to_id, config.get("aliases")
+    )
+    print_splits(expenses, name_to_id)
+    print(f"{len(expenses)} expenses from {len(rows)} stored rows.")
+
+    if not args.upload_to_splitwise:
+        logging.info("NOT uploading to splitwise.")
+        return
+
+    new_expenses = expenses
+    if args.sync:
+        new_expenses = filter_new_expenses(splitwise_client, expenses, group_id)
+    logging.info("Uploading expenses to splitwise...")
+    results = splitwise_client.add_expenses(new_expenses, max_workers=args.max_workers)
+    store.record_uploads(rows, expenses, results)
+    if not all(result.success for result in results):
+        raise SystemExit(1)
+
+
+def run_upload_pipeline(
+    args, config: dict, splitwise_client: Splitwise_client, metrics: Run_metrics
+):
+    """run_upload with --pipeline: parsing, processing and uploading overlap."""
+
+    from async_pipeline import PipelineInterruptedError, run_pipeline
+
+    member_cache = Member_cache(splitwise_client, ttl_seconds=args.members_ttl)
+    if args.refresh_members:
+        member_cache.invalidate(config["group_id"])
+    interrupted = None
+    try:
+        result = run_pipeline(args, config, splitwise_client, member_cache, metrics)
+    except PipelineInterruptedError as e:
+        # What the pipeline got to is still recorded, so a replay doesn't duplicate it
+        result, interrupted = e.result, e
+
+    store = None if args.no_store else open_statement_store(args.store)
+    if store is not None and not result.statement.empty:
+        if args.local_extract:
+            parse_mode = LOCAL_PARSE_MODE
+        elif args.stream:
+            parse_mode = ASSISTANT_PARSE_MODE
+        else:
+            parse_mode = args.parse_mode
+        rows = store.append(
+            result.statement, args.statement_pdf, config["group_id"], parse_mode
+        )
+        if args.upload_to_splitwise:
+            store.record_uploads(
+                rows, [upload.expense for upload in result.results], result.results
+            )
+    if interrupted is not None:
+        logging.error(
+            f"The pipeline failed after {len(result.results)} uploads. Use the replay "
+            "command to upload the rest of the stored rows."
+        )
+        raise interrupted.__cause__ from None
+    if not all(upload.success for upload in result.results):
+        raise SystemExit(1)
+
+
+def run_upload(args):
+    from assignment_rules import Assignment_rules
+    from statement_pipeline import (
+        apply_learned,
+        cached_statement,
+        filter_new_expenses,
+        parse_statement,
+        process_statement,
+        stream_expenses,
+        stream_rows,
+    )
+
+    metrics = Run_metrics()
+    # Written however the run ends, including failures
+    atexit.register(write_metrics, metrics, args.metrics_json, args.metrics_prometheus)
+
+    splitwise_client = Splitwise_client(load_secrets(), metrics=metrics)
+
+    # Load the config JSON to get the group_id and payer name
+    config = load_config(args.config)
+    group_id = config["group_id"]
+    payer_name = config["payer_name"]
+
+    if args.pipeline:
+        run_upload_pipeline(args, config, splitwise_client, metrics)
+        return
+
+    # Fetch the group members (or reuse a recent fetch) and create a name-to-ID mapping
+    with metrics.stage("members"):
+        name_to_id = get_members(args, splitwise_client, group_id)
     actual_members = [x for x in list(name_to_id.keys()) if x != UNKNOWN_MEMBER_KEY]
 
-    # Upload file and create assistant
-    statement_parser = Bayclub_statement_parser(members=actual_members)
-    parsed_statement = statement_parser.upload_and_parse(args.statement_pdf)
+    store = None if args.no_store else open_statement_store(args.store)
+    learned = get_learned(args, group_id, actual_members)
+
+    if args.stream:
+        # Kept so the rows can still be recorded if the stream fails partway
+        streamed_rows = []
+
+        def collect(rows):
+            for row in rows:
+                streamed_rows.append(row)
+                yield row
+
+        expenses = stream_expenses(
+            collect(
+                stream_rows(
+                    args.statement_pdf, actual_members, args.refresh_parse, metrics
+                )
+            ),
+            actual_members,
+            group_id,
+            payer_name,
+            name_to_id,
+            config.get("aliases"),
+            learned,
+        )
+        results = None
+        interrupted = None
+        if args.upload_to_splitwise:
+            # Uploads start as soon as the first expense is yielded
+            logging.info("Uploading expenses to splitwise as they're parsed...")
+            try:
+                with metrics.stage("stream"):
+                    results = splitwise_client.add_expenses(
+                        expenses, max_workers=args.max_workers
+                    )
+            except UploadInterruptedError as e:
+                results, interrupted = e.results, e
+        else:
+            for expense in expenses:
+                pprint.pprint(expense)
+            logging.info("NOT uploading to splitwise.")
+
+        # The whole statement is only known (and cached) once the stream has ended
+        statement = cached_statement(
+            args.statement_pdf, actual_members, ASSISTANT_PARSE_MODE, learned
+        )
+        if statement is None and interrupted is not None and streamed_rows:
+            import pandas as pd
+
+            # ...so after a failure, only the rows streamed so far are recorded
+            statement = apply_learned(
+                Assignment_rules(actual_members).apply(
+                    pd.DataFrame([row.model_dump() for row in streamed_rows])
+                ),
+                learned,
+            )
+        if store is not None and statement is not None:
+            rows = store.append(
+                statement, args.statement_pdf, group_id, ASSISTANT_PARSE_MODE
+            )
+            if results is not None:
+                store.record_uploads(
+                    rows, [result.expense for result in results], results
+                )
+        if interrupted is not None:
+            logging.error(
+                f"The stream failed after {len(results)} uploads. To upload the rest "
+                "without duplicates, re-run without --stream and with --sync."
+            )
+            raise interrupted.__cause__ from None
+        if results is not None and not all(result.success for result in results):
+            raise SystemExit(1)
+        return
+
+    with metrics.stage("parse_statement"):
+        parsed_statement = parse_statement(
+            args.statement_pdf,
+            actual_members,
+            local_extract=args.local_extract,
+            offline=args.offline,
+            refresh_parse=args.refresh_parse,
+            pages_per_chunk=args.pages_per_chunk,
+            parallel_chunks=args.parallel_chunks,
+            parse_mode=args.parse_mode,
+            metrics=metrics,
+            learned=learned,
+        )
 
-    logging.info("Got parsed statement. Thank you GPT <3")
     print(parsed_statement)
 
+    rows = None
+    if store is not None:
+        rows = store.append(
+            parsed_statement,
+            args.statement_pdf,
+            group_id,
+            LOCAL_PARSE_MODE if args.local_extract else args.parse_mode,
+        )
+
     # Process the CSV and add expenses
-    expenses = process_statement(parsed_statement, group_id, payer_name, name_to_id)
+    with metrics.stage("process_statement"):
+        expenses = process_statement(
+            parsed_statement, group_id, payer_name, name_to_id, config.get("aliases")
+        )
 
     pprint.pprint(expenses)
 
     if args.upload_to_splitwise:
+        new_expenses = expenses
+        if args.sync:
+            with metrics.stage("sync"):
+                new_expenses = filter_new_expenses(splitwise_client, expenses, group_id)
+
         logging.info("Uploading expenses to splitwise...")
-        for expense in expenses:
-            splitwise_client.add_expense(expense)
+        with metrics.stage("upload"):
+            results = splitwise_client.add_expenses(
+                new_expenses, max_workers=args.max_workers
+            )
+        if rows is not None:
+            store.record_uploads(rows, expenses, results)
+        if not all(result.success for result in results):
+            raise SystemExit(1)
     else:
         logging.info("NOT uploading to splitwise.")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.command == VALIDATE_CONFIG_COMMAND:
+        run_validate_config(args)
+    elif args.command == PREVIEW_COMMAND:
+        run_preview(args)
+    elif args.command == QUERY_COMMAND:
+        run_query(args)
+    elif args.command == REPLAY_COMMAND:
+        run_replay(args)
+    elif args.command == LEARN_COMMAND:
+        run_learn(args)
+    elif args.command == COMPACT_COMMAND:
+        run_compact(args)
+    else:
+        run_upload(args)